@@ -21,28 +21,260 @@ tess2vtu
 
 This script converts a tesseroid model created with the tool tesseroids
 (http://tesseroids.leouieda.com) into a vtu file that, e.g. can be opened with
-ParaView.
+ParaView. Large models can be converted in chunks to several vtu pieces that
+are combined by a pvtu file.
 
 Christian Meeßen, 2018
 """
 
-if __name__ == "__main__":
-    import sys
+import os
+import io
+import zlib
+import base64
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Corners of a tesseroid [W, E, S, N, top, bot] in VTK_HEXAHEDRON order: the
+# top face from the north-west corner clockwise, then the bottom face
+CORNER_LON = [0, 1, 1, 0, 0, 1, 1, 0]
+CORNER_LAT = [3, 3, 2, 2, 3, 3, 2, 2]
+CORNER_HEIGHT = [4, 4, 4, 4, 5, 5, 5, 5]
+
+# VTK cell type of a hexahedron
+VTK_HEXAHEDRON = 12
+
+# VTK names of the numpy data types
+VTK_TYPES = dict(float32='Float32', float64='Float64', int32='Int32',
+                 int64='Int64', uint8='UInt8')
+
+
+def read_model(fmodel):
+    """
+    Read a tesseroid model.
+
+    Parameters:
+
+    * fmodel : str
+        Tesseroid model file with the columns W E S N top bottom density
+
+    Returns:
+
+    * model : numpy array
+        Array of structure [cells, 7]
+    """
+    return np.loadtxt(fmodel, ndmin=2)
+
+
+def subdivide(model, n):
+    """
+    Split every tesseroid into n x n tesseroids of equal size in longitude
+    and latitude, e.g. to approximate the curvature of large tesseroids
+    after spherical().
+
+    Parameters:
+
+    * model : numpy array
+        Array of structure [cells, 7] with W E S N top bottom density
+    * n : int
+        Number of parts in longitude and in latitude, n >= 1. n = 1 returns
+        the model unchanged.
+
+    Returns:
+
+    * model : numpy array
+        Array of structure [cells*n*n, 7]
+    """
+    model = np.asarray(model)
+    if n < 1:
+        raise ValueError('Subdivision must be at least 1', n)
+    if n == 1:
+        return model
+    steps = np.arange(n + 1)/float(n)
+    lon = model[:, 0, None] + (model[:, 1] - model[:, 0])[:, None]*steps
+    lat = model[:, 2, None] + (model[:, 3] - model[:, 2])[:, None]*steps
+    sub = np.empty([model.shape[0], n, n, 7])
+    sub[:, :, :, 0] = lon[:, :-1, None]
+    sub[:, :, :, 1] = lon[:, 1:, None]
+    sub[:, :, :, 2] = lat[:, None, :-1]
+    sub[:, :, :, 3] = lat[:, None, 1:]
+    sub[:, :, :, 4:] = model[:, None, None, 4:]
+    return sub.reshape(-1, 7)
+
+
+def _index_type(n):
+    # Indices up to n are stored as Int32 if possible, else as Int64
+    return np.int32 if n <= np.iinfo(np.int32).max else np.int64
+
+
+def hexahedra(model):
+    """
+    Build the unstructured grid of a tesseroid model with one hexahedron per
+    tesseroid and eight corner points per cell. Longitude, latitude and
+    height are used as x, y and z.
+
+    Parameters:
+
+    * model : numpy array
+        Array of structure [cells, 7] with W E S N top bottom density
+
+    Returns:
+
+    * mesh : dict
+        'points' [ncells*8, 3] as float32, 'connectivity' [ncells, 8] and
+        'offsets' [ncells] as int32, or int64 if ncells*8 exceeds the int32
+        range, 'types' [ncells] as uint8 and the cell data 'density' [ncells]
+    """
+    model = np.asarray(model)
+    ncells = model.shape[0]
+    itype = _index_type(ncells*8 + 8)
+    points = np.empty([ncells, 8, 3], dtype=np.float32)
+    points[:, :, 0] = model[:, CORNER_LON]
+    points[:, :, 1] = model[:, CORNER_LAT]
+    points[:, :, 2] = model[:, CORNER_HEIGHT]
+    return dict(
+        points=points.reshape(-1, 3),
+        connectivity=np.arange(ncells*8, dtype=itype).reshape(-1, 8),
+        offsets=np.arange(8, ncells*8 + 8, 8, dtype=itype),
+        types=np.full(ncells, VTK_HEXAHEDRON, dtype=np.uint8),
+        density=model[:, 6].copy()
+    )
+
+
+def merge_points(mesh, tolerance=None):
+    """
+    Merge corner points that coincide within a tolerance, so that adjacent
+    cells share their vertices and the grid is connected.
+
+    Coordinates are rounded to multiples of the tolerance and equal rounded
+    points are merged into the first of them, so two points closer than the
+    tolerance can still be kept apart if they fall on different sides of a
+    rounding boundary.
+
+    Parameters:
+
+    * mesh : dict
+        Mesh as returned by hexahedra()
+    * tolerance : float or list of float
+        Tolerance for all or each coordinate axis. Default is 1e-6 times the
+        extent of the points along each axis.
+
+    Returns:
+
+    * mesh : dict
+        Mesh with unique points and the connectivity pointing to them. The
+        other arrays are shared with the input mesh.
+    """
+    points = mesh['points']
+    if tolerance is None:
+        extent = points.max(axis=0).astype(float) - points.min(axis=0)
+        tolerance = np.where(extent > 0, 1e-6*extent, 1.0)
+    tolerance = np.broadcast_to(np.asarray(tolerance, dtype=float), (3,))
+    keys = np.rint(points/tolerance).astype(np.int64)
+    keys -= keys.min(axis=0)
+    size = keys.max(axis=0) + 1
+    if float(size[0])*size[1]*size[2] < 2**63:
+        # Sorting one combined integer key is much faster than unique rows
+        keys = (keys[:, 0]*size[1] + keys[:, 1])*size[2] + keys[:, 2]
+        _, index, inverse = np.unique(keys, return_index=True,
+                                      return_inverse=True)
+    else:
+        _, index, inverse = np.unique(keys, axis=0, return_index=True,
+                                      return_inverse=True)
+    merged = dict(mesh)
+    merged['points'] = points[index]
+    merged['connectivity'] = inverse.reshape(-1)[mesh['connectivity']] \
+        .astype(_index_type(len(index)))
+    return merged
+
+
+def spherical(mesh, radius=6371000., vexag=1.):
+    """
+    Project the points of a mesh from longitude, latitude and height onto
+    a sphere. x points to longitude 0 and z to the north pole.
+
+    Parameters:
+
+    * mesh : dict
+        Mesh as returned by hexahedra() or merge_points()
+    * radius : float
+        Radius in m of the sphere that the heights refer to
+    * vexag : float
+        Vertical exaggeration of the heights
+
+    Returns:
+
+    * mesh : dict
+        Mesh with cartesian points in m. The other arrays are shared with
+        the input mesh.
+    """
+    points = mesh['points']
+    lon = np.radians(points[:, 0], dtype=float)
+    lat = np.radians(points[:, 1], dtype=float)
+    r = radius + vexag*points[:, 2].astype(float)
+    xyz = np.empty(points.shape, dtype=points.dtype)
+    xyz[:, 0] = r*np.cos(lat)*np.cos(lon)
+    xyz[:, 1] = r*np.cos(lat)*np.sin(lon)
+    xyz[:, 2] = r*np.sin(lat)
+    projected = dict(mesh)
+    projected['points'] = xyz
+    return projected
+
+
+def _write_ascii(f, arr, fmt, ncols):
+    """
+    Write the values of arr as indented ascii with ncols values per line.
+    """
+    arr = np.asarray(arr).ravel()
+    nfull = arr.size//ncols*ncols
+    row = '          ' + ' '.join([fmt]*ncols) + '\n'
+    # Format blocks of rows at once instead of row by row
+    block = 100000*ncols
+    for i in range(0, nfull, block):
+        values = arr[i:min(i + block, nfull)]
+        f.write((row*(values.size//ncols)) % tuple(values.tolist()))
+    if nfull < arr.size:
+        values = arr[nfull:]
+        row = '          ' + ' '.join([fmt]*values.size) + '\n'
+        f.write(row % tuple(values.tolist()))
 
-    if len(sys.argv) < 2:
-        print 'Not enough arguments!'
-        print 'Usage: tess2vtu FilIn'
-        sys.exit()
 
-    import numpy as np
-    import os
+def _encode(arr, compress=None, blocksize=2**20):
+    """
+    Encode an array as binary VTK data with UInt64 headers.
+
+    Parameters:
 
-    fmodel = sys.argv[1]
-    fvtu = os.path.splitext(fmodel)[0]+'.vtu'
+    * arr : numpy array
+        Data array
+    * compress : int
+        zlib compression level, None for uncompressed data
+    * blocksize : int
+        Size of the compressed blocks in bytes
+
+    Returns:
+
+    * header : bytes
+        Byte count of the data, or the block sizes for compressed data
+    * data : list
+        Buffers of the data, written without copying if uncompressed
+    """
+    data = np.ascontiguousarray(arr, dtype=arr.dtype.newbyteorder('<'))
+    data = memoryview(data).cast('B')
+    nbytes = len(data)
+    if compress is None:
+        return np.array([nbytes], dtype='<u8').tobytes(), [data]
+    blocks = [zlib.compress(data[i:i + blocksize], compress)
+              for i in range(0, nbytes, blocksize)]
+    last = nbytes - (len(blocks) - 1)*blocksize if blocks else 0
+    header = [len(blocks), blocksize, last] + [len(b) for b in blocks]
+    return np.array(header, dtype='<u8').tobytes(), blocks
 
-    raw_model = np.loadtxt(fmodel)
 
+def write_vtu(fvtu, mesh, format='appended', compress=None):
     """
+    Write an unstructured grid as vtu file.
+
     A vtu file consists of the following xml blocks
 
     <Points>
@@ -59,107 +291,308 @@ if __name__ == "__main__":
       <DataArray type="Int32" Name="offsets" format="ascii">
         NPointsCell1 NPointsCell1+NPointsCell2 .
       </DataArray>
-    """
 
-    points = []
-    connectivity = []
-    prop_dens = []
-    P8 = -1
-    for p in raw_model:
-        [W, E, S, N, top, bot, dens] = p
-        points.append([W, N, top])
-        points.append([E, N, top])
-        points.append([E, S, top])
-        points.append([W, S, top])
-        points.append([W, N, bot])
-        points.append([E, N, bot])
-        points.append([E, S, bot])
-        points.append([W, S, bot])
-        P1 = P8 + 1
-        P2 = P1 + 1
-        P3 = P2 + 1
-        P4 = P3 + 1
-        P5 = P4 + 1
-        P6 = P5 + 1
-        P7 = P6 + 1
-        P8 = P7 + 1
-        prop_dens.append(dens)
-        connectivity.append([P1, P2, P3, P4, P5, P6, P7, P8])
-
-    npoints = len(points)
-    ncells = len(connectivity)
-    offsets = range(8, ncells*8+8, 8)
-
-    f = open(fvtu, 'w')
+    With format="appended" the DataArrays only contain the offset of their
+    data in a raw binary AppendedData block at the end of the file, with
+    format="binary" the data is base64 encoded within the DataArray.
+
+    Parameters:
+
+    * fvtu : str
+        Output file name
+    * mesh : dict
+        Mesh as returned by hexahedra()
+    * format : str
+        'ascii', 'binary' (base64) or 'appended' (raw binary)
+    * compress : int
+        zlib compression level 1-9 of binary data, None for uncompressed
+    """
+    if format not in ['ascii', 'binary', 'appended']:
+        raise ValueError('Unknown format', format)
+    if format == 'ascii':
+        compress = None
+    npoints = mesh['points'].shape[0]
+    ncells = mesh['offsets'].shape[0]
+    # Arrays of each section as (name, array, components, values per line)
+    sections = [
+        ('Points', '', [('Points', mesh['points'], 3, 3)]),
+        ('Cells', '', [('connectivity', mesh['connectivity'], 1, 8),
+                       ('offsets', mesh['offsets'], 1, 10),
+                       ('types', mesh['types'], 1, 10)]),
+        ('CellData', ' Scalars="PROPERTIES"',
+         [('Density', mesh['density'], 1, 1)])
+    ]
 
     h = '<?xml version="1.0"?>\n' \
-        '<VTKFile type="UnstructuredGrid" version="0.1" ' \
-        'byte_order="LittleEndian">\n' \
+        '<VTKFile type="UnstructuredGrid" version="1.0" ' \
+        'byte_order="LittleEndian" header_type="UInt64"'
+    if compress is not None:
+        h += ' compressor="vtkZLibDataCompressor"'
+    h += '>\n' \
         '  <UnstructuredGrid>\n' \
-        '    <Piece NumberOfPoints="{0}" NumberOfCells="{1}">\n' \
-        '      <Points>\n' \
-        '        <DataArray type="Float32" NumberOfComponents="3" ' \
-        'format="ascii">\n'.format(str(npoints), str(ncells))
-    f.write(h)
-    for p in points:
-        f.write('          {0} {1} {2}\n'.format(str(p[0]),
-                                                 str(p[1]),
-                                                 str(p[2])))
-    h = '        </DataArray>\n' \
-        '      </Points>\n' \
-        '      <Cells>\n' \
-        '        <DataArray type="Int32" Name="connectivity" format="ascii">\n'
-    f.write(h)
-    for p in connectivity:
-        f.write('          {0} {1} {2} {3} {4} {5} {6} {7}\n'.format(str(p[0]),
-                                                                     str(p[1]),
-                                                                     str(p[2]),
-                                                                     str(p[3]),
-                                                                     str(p[4]),
-                                                                     str(p[5]),
-                                                                     str(p[6]),
-                                                                     str(p[7])))
-    h = '        </DataArray>\n' \
-        '        <DataArray type="Int32" Name="offsets" format="ascii">\n'
-    f.write(h)
-    i = 0
-    for p in offsets:
-        if i == 0:
-            f.write('          ')
-        else:
-            f.write(' ')
-        f.write(str(p))
-        if i == 9:
-            f.write('\n')
-            i = 0
-        else:
-            i += 1
-    h = '        </DataArray>\n' \
-        '        <DataArray type="Int32" Name="types" format="ascii">\n'
-    f.write(h)
-    i = 0
-    for p in offsets:
-        if i == 0:
-            f.write('          ')
-        else:
-            f.write(' ')
-        f.write('12')
-        if i == 9:
-            f.write('\n')
-            i = 0
-        else:
-            i += 1
-    h = '        </DataArray>\n' \
-        '      </Cells>\n' \
-        '      <CellData Scalars="PROPERTIES">\n' \
-        '        <DataArray type="Float64" Name="Density" format="ascii">\n'
-    f.write(h)
-    for p in prop_dens:
-        f.write('          '+str(p)+'\n')
-    h = '        </DataArray>\n' \
-        '      </CellData>\n' \
-        '    </Piece>\n' \
-        '  </UnstructuredGrid>\n' \
-        '</VTKFile>\n'
-    f.write(h)
+        '    <Piece NumberOfPoints="{0}" NumberOfCells="{1}">\n'.format(
+            str(npoints), str(ncells))
+    f = open(fvtu, 'wb')
+    f.write(h.encode())
+    appended = []
+    offset = 0
+    for section, attributes, arrays in sections:
+        f.write('      <{}{}>\n'.format(section, attributes).encode())
+        for name, arr, ncomp, ncols in arrays:
+            h = '        <DataArray type="{}" Name="{}" ' \
+                'NumberOfComponents="{}" format="{}"'.format(
+                    VTK_TYPES[arr.dtype.name], name, ncomp, format)
+            if format == 'appended':
+                header, data = _encode(arr, compress)
+                appended.append((header, data))
+                f.write('{} offset="{}"/>\n'.format(h, offset).encode())
+                offset += len(header) + sum(len(d) for d in data)
+                continue
+            f.write((h + '>\n').encode())
+            if format == 'ascii':
+                fmt = '%.9g' if arr.dtype == np.float32 else \
+                    '%.17g' if arr.dtype.kind == 'f' else '%d'
+                text = io.TextIOWrapper(f, write_through=True)
+                _write_ascii(text, arr, fmt, ncols)
+                text.detach()
+            else:
+                header, data = _encode(arr, compress)
+                f.write(b'          ')
+                if compress is None:
+                    f.write(base64.b64encode(header + b''.join(data)))
+                else:
+                    f.write(base64.b64encode(header))
+                    f.write(base64.b64encode(b''.join(data)))
+                f.write(b'\n')
+            f.write(b'        </DataArray>\n')
+        f.write('      </{}>\n'.format(section).encode())
+    f.write(b'    </Piece>\n'
+            b'  </UnstructuredGrid>\n')
+    if format == 'appended':
+        f.write(b'  <AppendedData encoding="raw">\n   _')
+        for header, data in appended:
+            f.write(header)
+            for d in data:
+                f.write(d)
+        f.write(b'\n  </AppendedData>\n')
+    f.write(b'</VTKFile>\n')
     f.close()
+
+
+def build_mesh(model, n=1, merge=False, tolerance=None, radius=None,
+               vexag=1.):
+    """
+    Build the mesh of a tesseroid model with the optional subdivision,
+    merging of points and spherical projection.
+
+    Parameters:
+
+    * model : numpy array
+        Array of structure [cells, 7] with W E S N top bottom density
+    * n : int
+        Split every tesseroid into n x n cells, see subdivide()
+    * merge : bool
+        Merge coinciding points, see merge_points()
+    * tolerance : float
+        Tolerance for merging points
+    * radius : float
+        Radius of the sphere in m, None keeps longitude, latitude and
+        height as coordinates, see spherical()
+    * vexag : float
+        Vertical exaggeration of the spherical projection
+
+    Returns:
+
+    * mesh : dict
+        Mesh as returned by hexahedra()
+    """
+    mesh = hexahedra(subdivide(model, n))
+    if merge:
+        mesh = merge_points(mesh, tolerance)
+    if radius is not None:
+        mesh = spherical(mesh, radius, vexag)
+    return mesh
+
+
+def _chunk_ranges(fmodel, chunk_bytes):
+    """
+    Split a file into byte ranges of about chunk_bytes that end at line
+    breaks.
+    """
+    size = os.path.getsize(fmodel)
+    bounds = [0]
+    with open(fmodel, 'rb') as f:
+        while bounds[-1] < size:
+            f.seek(bounds[-1] + chunk_bytes)
+            f.readline()
+            bounds.append(min(f.tell(), size))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _convert_piece(fmodel, start, stop, fvtu, options, format, compress):
+    """
+    Convert the tesseroids in bytes start:stop of a model file to a vtu
+    piece. Returns the number of points and cells of the piece.
+    """
+    with open(fmodel, 'rb') as f:
+        f.seek(start)
+        lines = f.read(stop - start).decode().splitlines()
+    model = np.loadtxt(lines, ndmin=2) if lines else np.empty([0, 7])
+    if model.shape[0] == 0:
+        return 0, 0
+    mesh = build_mesh(model, **options)
+    write_vtu(fvtu, mesh, format, compress)
+    return mesh['points'].shape[0], mesh['offsets'].shape[0]
+
+
+def write_pvtu(fpvtu, pieces, points_type='Float32'):
+    """
+    Write the parallel vtu file that combines vtu pieces.
+
+    Parameters:
+
+    * fpvtu : str
+        Output file name
+    * pieces : list of str
+        File names of the pieces relative to fpvtu
+    * points_type : str
+        VTK type of the points
+    """
+    h = '<?xml version="1.0"?>\n' \
+        '<VTKFile type="PUnstructuredGrid" version="1.0" ' \
+        'byte_order="LittleEndian" header_type="UInt64">\n' \
+        '  <PUnstructuredGrid GhostLevel="0">\n' \
+        '    <PPoints>\n' \
+        '      <PDataArray type="{}" NumberOfComponents="3"/>\n' \
+        '    </PPoints>\n' \
+        '    <PCellData Scalars="PROPERTIES">\n' \
+        '      <PDataArray type="Float64" Name="Density"/>\n' \
+        '    </PCellData>\n'.format(points_type)
+    with open(fpvtu, 'w') as f:
+        f.write(h)
+        for piece in pieces:
+            f.write('    <Piece Source="{}"/>\n'.format(piece))
+        f.write('  </PUnstructuredGrid>\n'
+                '</VTKFile>\n')
+
+
+def convert_chunked(fmodel, fpvtu, chunk_bytes=64*1024**2, workers=None,
+                    format='appended', compress=None, verbose=True,
+                    **options):
+    """
+    Convert a tesseroid model in chunks to vtu pieces and a pvtu file that
+    combines them. The chunks are read and converted in parallel by a pool
+    of worker processes, so memory use is bounded by the chunk size times
+    the number of workers, independent of the size of the model.
+
+    Parameters:
+
+    * fmodel : str
+        Tesseroid model file
+    * fpvtu : str
+        Output .pvtu file. The pieces are written to a directory of the
+        same name without extension.
+    * chunk_bytes : int
+        Approximate size of the part of fmodel converted to one piece
+    * workers : int
+        Number of worker processes, default is the number of CPUs
+    * format, compress
+        Format of the pieces, see write_vtu()
+    * verbose : bool
+        Print progress
+    * options
+        Options of build_mesh(). Points are only merged within a piece.
+
+    Returns:
+
+    * npoints, ncells : int
+        Total number of points and cells
+    """
+    base = os.path.splitext(fpvtu)[0]
+    folder = os.path.basename(base)
+    if not os.path.isdir(base):
+        os.makedirs(base)
+    ranges = _chunk_ranges(fmodel, chunk_bytes)
+    names = [os.path.join(folder, '{}_{:04d}.vtu'.format(folder, i))
+             for i in range(len(ranges))]
+    root = os.path.dirname(os.path.abspath(fpvtu))
+    counts = [None]*len(ranges)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = dict(
+            (pool.submit(_convert_piece, fmodel, start, stop,
+                         os.path.join(root, name), options, format,
+                         compress), i)
+            for i, ((start, stop), name) in enumerate(zip(ranges, names)))
+        for future in as_completed(futures):
+            i = futures[future]
+            counts[i] = future.result()
+            if verbose:
+                print('> Piece {:d} / {:d}: {:d} cells'.format(
+                    i + 1, len(ranges), counts[i][1]))
+    pieces = [name for name, count in zip(names, counts) if count[1] > 0]
+    write_pvtu(fpvtu, pieces)
+    return sum(c[0] for c in counts), sum(c[1] for c in counts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='tess2vtu',
+        description='Convert a tesseroid model to a vtu file.')
+    parser.add_argument('fmodel', metavar='FilIn', help='Tesseroid model')
+    parser.add_argument('-o', '--output',
+                        help='Output file name (default: FilIn with .vtu)')
+    parser.add_argument('-f', '--format', default='appended',
+                        choices=['ascii', 'binary', 'appended'],
+                        help='Data format: raw binary appended to the file '
+                        '(default), base64 encoded binary or ascii')
+    parser.add_argument('-m', '--merge', action='store_true',
+                        help='Merge coinciding corner points of adjacent '
+                        'tesseroids')
+    parser.add_argument('-t', '--tolerance', type=float,
+                        help='Tolerance for merging points (default: 1e-6 '
+                        'times the model extent along each axis)')
+    parser.add_argument('-s', '--spherical', action='store_true',
+                        help='Project the model onto a sphere instead of '
+                        'using longitude, latitude and height as x, y and z')
+    parser.add_argument('-n', '--subdivide', type=int, default=1,
+                        help='Split every tesseroid into N x N cells to '
+                        'approximate the curvature (default: 1)')
+    parser.add_argument('-r', '--radius', type=float, default=6371000.,
+                        help='Radius of the sphere in m (default: 6371000)')
+    parser.add_argument('-v', '--vexag', type=float, default=1.,
+                        help='Vertical exaggeration (default: 1)')
+    parser.add_argument('-c', '--chunk', type=float, metavar='MB',
+                        help='Convert the model in chunks of this size to '
+                        'vtu pieces combined by a .pvtu file, for models '
+                        'that do not fit into memory')
+    parser.add_argument('-j', '--workers', type=int,
+                        help='Number of processes converting chunks '
+                        '(default: number of CPUs)')
+    parser.add_argument('-z', '--compress', type=int, choices=range(1, 10),
+                        metavar='LEVEL', help='zlib compression level 1-9 '
+                        'of binary data')
+    args = parser.parse_args(argv)
+
+    if args.subdivide < 1:
+        parser.error('N must be at least 1')
+    options = dict(n=args.subdivide, merge=args.merge,
+                   tolerance=args.tolerance, vexag=args.vexag,
+                   radius=args.radius if args.spherical else None)
+    fvtu = args.output
+    if args.chunk is not None:
+        if fvtu is None:
+            fvtu = os.path.splitext(args.fmodel)[0]+'.pvtu'
+        npoints, ncells = convert_chunked(
+            args.fmodel, fvtu, int(args.chunk*1024**2), args.workers,
+            args.format, args.compress, **options)
+        print('Wrote {:d} cells and {:d} points to {}'.format(
+            ncells, npoints, fvtu))
+        return
+    if fvtu is None:
+        fvtu = os.path.splitext(args.fmodel)[0]+'.vtu'
+    write_vtu(fvtu, build_mesh(read_model(args.fmodel), **options),
+              args.format, args.compress)
+
+
+if __name__ == "__main__":
+    main()
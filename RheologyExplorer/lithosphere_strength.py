@@ -0,0 +1,404 @@
+################################################################################
+#                     Copyright (C) 2019 by Christian Meessen                  #
+#                                                                              #
+#                         This file is part of Scripts                         #
+#                                                                              #
+#        Scripts is free software: you can redistribute it and/or modify       #
+#     it under the terms of the GNU General Public License as published by     #
+#           the Free Software Foundation version 3 of the License.             #
+#                                                                              #
+#      GMTScripts is distributed in the hope that it will be useful, but       #
+#          WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU       #
+#                   General Public License for more details.                   #
+#                                                                              #
+#      You should have received a copy of the GNU General Public License       #
+#       along with Scripts. If not, see <http://www.gnu.org/licenses/>.        #
+################################################################################
+"""
+Yield strength of a layered GMS lithosphere model.
+
+The layer geometry is read from the GMS files also used by VoxelIsostasy
+(*_lay.dat, *_strat.dat, the surface and t_<layer>.dat thickness maps). Every
+layer is assigned a material of rheology_explorer.materials() and the
+differential stress is computed for every cell of a temperature voxel. The
+voxel is processed in chunks of x-rows, so temperature input and stress output
+can be memory mapped .npy files that are larger than RAM.
+"""
+import os
+import sys
+import numpy as np
+
+# GMS files are read with the cached reader of VoxelIsostasy
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'Tools', 'VoxelIsostasy'))
+from GMSGrid import read_gms_grid  # noqa: E402
+from VoxelIsostasy import grd2tab  # noqa: E402
+from rheology_explorer import materials, material_table, PROPERTIES, \
+    sigma_byerlee, sigma_creep, creep_table
+
+
+def load_gms_layers(project, path='.'):
+    """
+    Load the layer geometry of a GMS project.
+
+    Parameters
+    ----------
+    project : str
+        GMS project name, i.e. the prefix of *_lay.dat and *_strat.dat
+    path : str
+        Directory containing the project files
+
+    Returns
+    -------
+    model : dict
+        Dict with the keys 'layers' (list of layer names from top to
+        bottom), 'x', 'y' (1D coordinates), 'surface' (2D array of the top
+        surface elevation in m) and 'bottoms' (3D array [layer, x, y] with
+        the bottom elevation of each layer in m)
+    """
+    flay = os.path.join(path, project + '_lay.dat')
+    fstrat = os.path.join(path, project + '_strat.dat')
+    layers = []
+    with open(flay) as f:
+        for line in f:
+            if line.strip() and not line.startswith('#'):
+                layers.append(line.split()[0])
+    with open(fstrat) as f:
+        fsurf = [line.split()[2] for line in f if line.strip()][-1]
+    x, y, surface = read_gms_grid(os.path.join(path, fsurf))
+    thickness = np.empty([len(layers), len(x), len(y)])
+    for i, layer in enumerate(layers):
+        fthick = os.path.join(path, 't_' + layer + '.dat')
+        thickness[i] = read_gms_grid(fthick)[2]
+    bottoms = surface[None, :, :] - np.cumsum(thickness, axis=0)
+    return dict(layers=layers, x=x, y=y, surface=surface, bottoms=bottoms)
+
+
+def layer_columns(layers, layer_materials, mats=None):
+    """
+    Columnar material properties with one row per layer plus a trailing
+    row of NaN for cells that lie outside the model.
+
+    Parameters
+    ----------
+    layers : list
+        Layer names from top to bottom
+    layer_materials : dict
+        Maps each layer name to a material name or material record
+    mats : np.ndarray
+        Material table to look up names in, default is materials()
+
+    Returns
+    -------
+    columns : dict
+        Dict of 1D arrays of length len(layers) + 1 for each key in
+        PROPERTIES
+    """
+    if mats is None:
+        mats = materials()
+    records = np.empty(len(layers) + 1, dtype=mats.dtype)
+    records[-1] = material_table([dict()])[0]
+    for i, layer in enumerate(layers):
+        if layer not in layer_materials:
+            raise ValueError('No material assigned to layer', layer)
+        mat = layer_materials[layer]
+        if isinstance(mat, str):
+            idx = np.flatnonzero(mats['name'] == mat)
+            if len(idx) == 0:
+                raise ValueError('Unknown material', mat)
+            mat = mats[idx[0]]
+        elif isinstance(mat, dict):
+            mat = material_table([mat])[0]
+        records[i] = mat
+    return dict((prop, records[prop]) for prop in PROPERTIES)
+
+
+def _chunk_rows(shape, max_mem):
+    """
+    Number of x-rows per chunk for a voxel of the given shape such that
+    the temporary arrays stay below max_mem bytes.
+    """
+    # About 24 float64 temporaries per cell are alive at the same time
+    row_bytes = shape[1]*shape[2]*8*24
+    return int(max(1, max_mem//row_bytes))
+
+
+def strength_chunks(model, temp, z, layer_materials, strain_rate,
+                    compute=None, tabulated=False, max_mem=256*1024**2):
+    """
+    Generator over chunks of x-rows of the model that yields the brittle
+    and creep strength of every cell.
+
+    Parameters
+    ----------
+    model : dict
+        Layer geometry as returned by load_gms_layers()
+    temp : np.array
+        Temperature voxel in K of structure [x, y, z]. May be a memory
+        mapped array.
+    z : np.array
+        1D array with the elevation of the voxel z-levels in m
+    layer_materials : dict
+        Maps each layer name to a material, see layer_columns()
+    strain_rate : float
+        Strain rate in 1/s
+    compute : list
+        List of creep processes, see sigma_creep()
+    tabulated : bool
+        Look up creep strength in the cached CreepTable of each layer
+        material, see rheology_explorer.creep_table()
+    max_mem : int
+        Approximate memory budget per chunk in bytes
+
+    Yields
+    ------
+    rows : slice
+        The x-rows of the chunk
+    depth : np.array
+        Depth below surface in m of structure [x, y, z], NaN above the
+        surface
+    s_compression, s_extension : np.array
+        Brittle strength (Byerlee's law) for compression and extension in
+        Pa
+    s_creep : np.array
+        Creep strength in Pa
+    """
+    z = np.asarray(z, dtype=float)
+    nx, ny = model['surface'].shape
+    shape = (nx, ny, z.shape[0])
+    if temp.shape != shape:
+        raise ValueError('Temperature voxel must have shape', shape)
+    columns = layer_columns(model['layers'], layer_materials)
+    nlay = len(model['layers'])
+    if tabulated:
+        tables = [creep_table(dict((k, v[i]) for k, v in columns.items()),
+                              compute=compute) for i in range(nlay)]
+    nrows = _chunk_rows(shape, max_mem)
+    for x0 in range(0, nx, nrows):
+        rows = slice(x0, min(x0 + nrows, nx))
+        depth = model['surface'][rows, :, None] - z[None, None, :]
+        # A cell belongs to the first layer whose bottom is below it.
+        # Cells below the model base get the trailing NaN material.
+        bottoms = model['bottoms'][:, rows, :, None]
+        idx = np.sum(bottoms >= z[None, None, None, :], axis=0)
+        above = depth < 0
+        idx[above] = nlay
+        depth[above] = np.nan
+        T = np.asarray(temp[rows], dtype=float)
+        if tabulated:
+            cells = dict((k, columns[k][idx])
+                         for k in ['f_f_c', 'f_f_e', 'f_p', 'rho_b'])
+            s_creep = np.full(T.shape, np.nan)
+            for i in range(nlay):
+                mask = idx == i
+                s_creep[mask] = tables[i](T[mask], strain_rate)
+        else:
+            cells = dict((k, v[idx]) for k, v in columns.items())
+            s_creep = sigma_creep(cells, T, strain_rate, compute=compute)
+        s_c = sigma_byerlee(cells, depth, 'compression')
+        s_e = sigma_byerlee(cells, depth, 'extension')
+        yield rows, depth, s_c, s_e, s_creep
+
+
+def strength_cube(model, temp, z, layer_materials, strain_rate,
+                  mode='compression', fout=None, compute=None,
+                  tabulated=False, max_mem=256*1024**2):
+    """
+    Compute the differential stress for every cell of a temperature voxel.
+
+    Parameters
+    ----------
+    model : dict
+        Layer geometry as returned by load_gms_layers()
+    temp : np.array
+        Temperature voxel in K of structure [x, y, z]. Use
+        np.load(fname, mmap_mode='r') for voxels larger than RAM.
+    z : np.array
+        1D array with the elevation of the voxel z-levels in m
+    layer_materials : dict
+        Maps each layer name to a material, see layer_columns()
+    strain_rate : float
+        Strain rate in 1/s
+    mode : str
+        'compression' or 'extension'
+    fout : str
+        If given, the result is written chunk by chunk to this .npy file
+        and returned as memory mapped array
+    compute : list
+        List of creep processes, see sigma_creep()
+    tabulated : bool
+        Look up creep strength in the cached CreepTable of each layer
+        material, see rheology_explorer.creep_table()
+    max_mem : int
+        Approximate memory budget per chunk in bytes
+
+    Returns
+    -------
+    dsigma : np.array
+        Differential stress in Pa of structure [x, y, z], negative for
+        compression and NaN outside of the model
+    """
+    if mode not in ['compression', 'extension']:
+        raise ValueError('Invalid parameter for mode:', mode)
+    shape = temp.shape
+    if fout is None:
+        dsigma = np.empty(shape, dtype=float)
+    else:
+        dsigma = np.lib.format.open_memmap(fout, mode='w+', dtype=float,
+                                           shape=shape)
+    for rows, depth, s_c, s_e, s_creep in strength_chunks(
+            model, temp, z, layer_materials, strain_rate, compute=compute,
+            tabulated=tabulated, max_mem=max_mem):
+        if mode == 'compression':
+            dsigma[rows] = -1*np.fmin(s_c, s_creep)
+        else:
+            dsigma[rows] = np.fmin(s_e, s_creep)
+    if fout is not None:
+        dsigma.flush()
+    return dsigma
+
+
+def _first_transition(brittle, ductile, depth):
+    """
+    Depth of the first change from brittle to ductile deformation along
+    the last axis, NaN where there is none.
+    """
+    trans = brittle[..., :-1] & ductile[..., 1:]
+    k = np.argmax(trans, axis=-1)[..., None]
+    bdt = 0.5*(np.take_along_axis(depth[..., :-1], k, axis=-1) +
+               np.take_along_axis(depth[..., 1:], k, axis=-1))[..., 0]
+    bdt[~trans.any(axis=-1)] = np.nan
+    return bdt
+
+
+def _elastic_thickness(strong, edges):
+    """
+    Effective elastic thickness of decoupled layers, Te = (sum h_i^3)^(1/3),
+    where h_i is the thickness of the i-th contiguous strong layer of a
+    column (Burov and Diament, 1995).
+
+    Parameters
+    ----------
+    strong : np.array
+        Boolean array of structure [x, y, z]
+    edges : np.array
+        1D array of length nz + 1 with the cumulative cell thickness
+    """
+    nrows, ny, nz = strong.shape
+    padded = np.zeros([nrows*ny, nz + 2], dtype=np.int8)
+    padded[:, 1:-1] = strong.reshape(-1, nz)
+    change = np.diff(padded, axis=1)
+    # np.nonzero returns row-major order, so starts and ends of the strong
+    # layers pair up column by column
+    col, start = np.nonzero(change == 1)
+    end = np.nonzero(change == -1)[1]
+    h = edges[end] - edges[start]
+    te = np.cbrt(np.bincount(col, weights=h**3, minlength=nrows*ny))
+    return te.reshape(nrows, ny)
+
+
+def strength_maps(model, temp, z, layer_materials, strain_rate,
+                  compute=None, tabulated=False, te_threshold=10e6,
+                  max_mem=256*1024**2):
+    """
+    Depth-integrated strength, brittle-ductile transition depth and
+    effective elastic thickness for every column of the model. The
+    envelopes are reduced chunk by chunk and never stored.
+
+    Parameters
+    ----------
+    model : dict
+        Layer geometry as returned by load_gms_layers()
+    temp : np.array
+        Temperature voxel in K of structure [x, y, z]
+    z : np.array
+        1D array with the elevation of the voxel z-levels in m, ordered
+        from top to bottom
+    layer_materials : dict
+        Maps each layer name to a material, see layer_columns()
+    strain_rate : float
+        Strain rate in 1/s
+    compute : list
+        List of creep processes, see sigma_creep()
+    tabulated : bool
+        Look up creep strength in the cached CreepTable of each layer
+        material, see rheology_explorer.creep_table()
+    te_threshold : float
+        Minimum strength in Pa of a mechanically strong layer
+    max_mem : int
+        Approximate memory budget per chunk in bytes
+
+    Returns
+    -------
+    maps : dict
+        2D arrays of structure [x, y] with the keys 'strength_compression'
+        and 'strength_extension' (magnitude of the integrated strength in
+        Pa*m), 'bdt_compression' and 'bdt_extension' (depth of the
+        uppermost brittle-ductile transition in m) and 'te_compression'
+        and 'te_extension' (effective elastic thickness in m)
+    """
+    z = np.asarray(z, dtype=float)
+    if np.any(np.diff(z) > 0):
+        raise ValueError('z must be ordered from top to bottom')
+    # Cell thickness of the trapezoidal rule
+    dz = -np.diff(z)
+    weights = np.zeros_like(z)
+    weights[:-1] += 0.5*dz
+    weights[1:] += 0.5*dz
+    edges = np.concatenate(([0.0], np.cumsum(weights)))
+    shape = model['surface'].shape
+    maps = dict()
+    for mode in ['compression', 'extension']:
+        for key in ['strength_', 'bdt_', 'te_']:
+            maps[key + mode] = np.empty(shape)
+    for rows, depth, s_c, s_e, s_creep in strength_chunks(
+            model, temp, z, layer_materials, strain_rate, compute=compute,
+            tabulated=tabulated, max_mem=max_mem):
+        ductile_mask = np.isfinite(s_creep)
+        for mode, s_b in [('compression', s_c), ('extension', s_e)]:
+            s = np.fmin(s_b, s_creep)
+            s[~np.isfinite(s_b)] = np.nan
+            maps['strength_' + mode][rows] = np.nansum(s*weights, axis=-1)
+            with np.errstate(invalid='ignore'):
+                brittle = s_b <= s_creep
+                ductile = ductile_mask & (s_creep < s_b)
+                strong = s >= te_threshold
+            maps['bdt_' + mode][rows] = _first_transition(brittle, ductile,
+                                                          depth)
+            maps['te_' + mode][rows] = _elastic_thickness(strong, edges)
+    return maps
+
+
+def save_maps(maps, model, prefix, info=''):
+    """
+    Write the maps of strength_maps() as X Y Z tables named
+    prefix_<key>.dat.
+
+    Parameters
+    ----------
+    maps : dict
+        Dict of 2D arrays of structure [x, y]
+    model : dict
+        Layer geometry as returned by load_gms_layers()
+    prefix : str
+        Prefix of the output file names
+    info : str
+        Additional line for the file header
+    """
+    import time
+    units = dict(strength='Pa*m', bdt='m', te='m')
+    x = model['x']
+    y = model['y']
+    for key, grd in sorted(maps.items()):
+        h = key.replace('_', ' ') + "\n"
+        h += "Created: " + time.ctime() + "\n"
+        if info:
+            h += info + "\n"
+        h += "Column information:\n"
+        h += "0 - X\n"
+        h += "1 - Y\n"
+        h += "2 - " + key + " / " + units[key.split('_')[0]]
+        np.savetxt(prefix + '_' + key + '.dat',
+                   grd2tab(grd, x[0], x[-1], y[0], y[-1]), fmt='%f',
+                   header=h)
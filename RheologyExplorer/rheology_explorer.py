@@ -15,14 +15,34 @@
 #      You should have received a copy of the GNU General Public License       #
 #       along with Scripts. If not, see <http://www.gnu.org/licenses/>.        #
 ################################################################################
+import os
 import numpy as np
-import matplotlib as mpl
-import matplotlib.pyplot as plt
+from collections import OrderedDict
+from functools import lru_cache
+
+# Numerical material properties, see materials() for a description
+PROPERTIES = ['f_f_e', 'f_f_c', 'f_p', 'rho_b',
+              'a_p', 'n', 'q_p',
+              'a_f', 'q_f', 'a', 'm',
+              'sigma_d', 'q_d', 'a_d']
+# Descriptive material properties
+TEXT_PROPERTIES = ['name', 'altname', 'source', 'source_disloc',
+                   'source_diff', 'source_dorn', 'via']
+MATERIAL_DTYPE = np.dtype([(k, 'U128') for k in TEXT_PROPERTIES] +
+                          [(k, 'f8') for k in PROPERTIES])
+
+_material_cache = None
+
+# Number of creep tables kept by creep_table()
+CREEP_TABLE_CACHE_SIZE = 32
+# Number of strain rates for which explorer() keeps the envelopes
+ENVELOPE_CACHE_SIZE = 32
 
 def materials():
     """
-    Contains a list of materials used for strength computation with exodus
-    module. Available properties are
+    Returns the built-in material library used for strength computation
+    with exodus module. The library is built once and cached; every call
+    returns a copy. Available properties are
 
     Meta properties
     ---------------
@@ -74,6 +94,26 @@ def materials():
         Dorn's law activation energy / J/mol
     a_d : float
         Dorn's law strain rate
+
+    Creep laws that a material does not have are set to NaN, text fields
+    that are not given are empty.
+
+    Returns
+    -------
+    table : np.ndarray
+        Structured array of dtype MATERIAL_DTYPE with one record per
+        material
+    """
+    global _material_cache
+    if _material_cache is None:
+        _material_cache = material_table(_builtin_materials())
+    return _material_cache.copy()
+
+
+def _builtin_materials():
+    """
+    List of dicts with the built-in materials, see materials() for the
+    available properties.
     """
     """
     Template
@@ -528,6 +568,113 @@ def materials():
     return r
 
 
+def material_table(records):
+    """
+    Convert material dicts into a structured array of dtype MATERIAL_DTYPE.
+    Numerical properties that are missing, None or empty are stored as
+    NaN, missing text properties as empty strings. Unknown keys are
+    ignored.
+
+    Parameters
+    ----------
+    records : list
+        List of dicts with material properties, see materials()
+
+    Returns
+    -------
+    table : np.ndarray
+        Structured array with one record per material
+    """
+    table = np.empty(len(records), dtype=MATERIAL_DTYPE)
+    for i, rec in enumerate(records):
+        for prop in TEXT_PROPERTIES:
+            value = rec.get(prop)
+            table[prop][i] = '' if value is None else ' '.join(
+                str(value).split())
+        for prop in PROPERTIES:
+            value = rec.get(prop)
+            if value is None or value == '':
+                table[prop][i] = np.nan
+            else:
+                table[prop][i] = float(value)
+    return table
+
+
+def load_materials(fname):
+    """
+    Load a material library from a CSV or JSON file. A CSV file must have
+    a header row with property names, empty cells mark missing
+    properties. A JSON file must contain a list of objects with property
+    names as keys.
+
+    Parameters
+    ----------
+    fname : str
+        File name ending with .csv or .json
+
+    Returns
+    -------
+    table : np.ndarray
+        Structured array of dtype MATERIAL_DTYPE
+    """
+    import os
+    ext = os.path.splitext(fname)[1].lower()
+    if ext == '.json':
+        import json
+        with open(fname) as f:
+            records = json.load(f)
+    elif ext == '.csv':
+        import csv
+        records = []
+        with open(fname) as f:
+            reader = csv.reader(f, skipinitialspace=True)
+            header = [k.strip() for k in next(reader, [])]
+            for row in reader:
+                if not row:
+                    continue
+                if len(row) != len(header):
+                    raise ValueError(
+                        '{}, line {}: expected {} fields, found {}'.format(
+                            fname, reader.line_num, len(header), len(row)))
+                records.append(dict(zip(header,
+                                        [v.strip() for v in row])))
+    else:
+        raise ValueError('Unknown material library format:', fname)
+    return material_table(records)
+
+
+def material_arrays(mats):
+    """
+    Columnar view of the numerical properties of several materials.
+
+    Parameters
+    ----------
+    mats : np.ndarray or list
+        Material table as returned by materials() or load_materials(), or a
+        list of material dicts
+
+    Returns
+    -------
+    columns : dict
+        Dict with one 1D float array of length len(mats) for each key in
+        PROPERTIES
+    """
+    if not isinstance(mats, np.ndarray):
+        mats = material_table(mats)
+    return dict((prop, mats[prop]) for prop in PROPERTIES)
+
+
+def _as_material(material):
+    """
+    Return material unchanged unless it is a dict that lacks properties,
+    in which case it is converted into a record of MATERIAL_DTYPE.
+    """
+    if isinstance(material, dict) and \
+            any(material.get(prop) is None for prop in PROPERTIES):
+        return material_table([material])[0]
+    return material
+
+
 def sigma_byerlee(material, z, mode):
     """
     Compute the byerlee differential stress. Requires the material
@@ -536,17 +683,17 @@ def sigma_byerlee(material, z, mode):
 
     Parameters
     ----------
-    material : dict
-        Dictionary with the material properties in SI units. The
-        required keys are 'f_f_e', 'f_f_c', 'f_p' and 'rho_b'
-    z : float
+    material : np.void or dict
+        Material record or dictionary with the material properties in SI
+        units. Required keys are 'f_f_e', 'f_f_c', 'f_p' and 'rho_b'
+    z : float or np.array
         Depth below surface in m
     mode : str
         'compression' or 'extension'
 
     Returns
     -------
-        sigma_d : float
+        sigma_d : float or np.array
     """
     if mode == 'compression':
         f_f = material['f_f_c']
@@ -557,12 +704,12 @@ def sigma_byerlee(material, z, mode):
     f_p = material['f_p']
     rho_b = material['rho_b']
     g = 9.81  # m/s2
-    return f_f*rho_b*g*z*(1.0 - f_p)
+    return f_f*rho_b*g*np.asarray(z)*(1.0 - f_p)
 
 def sigma_diffusion(material, temp, strain_rate):
     """
     Computes differential stress for diffusion creept at specified
-    temperature and strain rate. Material properties require grain size 'd',
+    temperature and strain rate. Material properties require grain size 'a',
     grain size exponent 'm', preexponential scaling factor for diffusion
     creep 'a_f', and activation energy 'q_f'.
 
@@ -570,27 +717,24 @@ def sigma_diffusion(material, temp, strain_rate):
 
     Parameters
     ----------
-    material : dict
-        Dictionary with the material properties in SI units. Required
-        keys are 'd', 'm', 'a_f', 'q_f'
-    temp : float
+    material : np.void or dict
+        Material record or dictionary with the material properties in SI
+        units. Required keys are 'a', 'm', 'a_f', 'q_f'
+    temp : float or np.array
         Temperature in Kelvin
     strain_rate : float
         Reference strain rate in 1/s
 
     Returns
     -------
-        sigma_diffusion : float
+        sigma_diffusion : float or np.array
     """
     R = 8.314472 #m2kg/s2/K/mol
-    d = material['d']
+    d = material['a']
     m = material['m']
     a_f = material['a_f']
     q_f = material['q_f']
-    if a_f is None:
-        return np.nan
-    else:
-        return d**m*strain_rate/a_f*np.exp(q_f/R/temp)
+    return d**m*strain_rate/a_f*np.exp(q_f/R/np.asarray(temp))
 
 def sigma_dislocation(material, temp, strain_rate):
     """
@@ -600,23 +744,23 @@ def sigma_dislocation(material, temp, strain_rate):
 
     Parameters
     ----------
-    material : dict
-        Dictionary with the material properties in SI units. Required
-        keys are 'a_p', 'n' and 'q_p'
-    temp : float
+    material : np.void or dict
+        Material record or dictionary with the material properties in SI
+        units. Required keys are 'a_p', 'n' and 'q_p'
+    temp : float or np.array
         Temperature in Kelvin
     strain_rate : float
         Reference strain rate in 1/s
 
     Returns
     -------
-        sigma_d : float
+        sigma_d : float or np.array
     """
     R = 8.314472 # m2kg/s2/K/mol
     a_p = material['a_p']
     n = material['n']
     q_p = material['q_p']
-    return (strain_rate/a_p)**(1.0/n)*np.exp(q_p/n/R/temp)
+    return (strain_rate/a_p)**(1.0/n)*np.exp(q_p/n/R/np.asarray(temp))
 
 def sigma_dorn(material, temp, strain_rate):
     """
@@ -628,102 +772,316 @@ def sigma_dorn(material, temp, strain_rate):
 
     sigma_delta = sigma_d*(1-(-R*T/Q*ln(strain_rate/A_d))^(1/q))
 
+    Negative stresses are clipped to zero.
+
     Parameters
     ----------
-    material : dict
-        Dictionary with the material properties in SI units. Required
-        keys are 'sigma_d', 'q_d' and 'A_p'
-    temp : float
+    material : np.void or dict
+        Material record or dictionary with the material properties in SI
+        units. Required keys are 'sigma_d', 'q_d' and 'A_p'
+    temp : float or np.array
         Temperature in Kelvin
     strain_rate : float
         Reference strain rate in 1/s
 
     Returns
     -------
-        sigma_d : float
+        sigma_d : float or np.array
+    """
+    return _dorn_stress(material, _dorn_term(material, temp, strain_rate))
+
+def _dorn_term(material, temp, strain_rate):
+    """
+    The term -R*T/Q*ln(strain_rate/A_d) of Dorn's law, which is linear in
+    temperature and in log strain rate.
     """
     R = 8.314472 # m2kg/s2/K/mol
-    sigma_d = material['sigma_d']
     q_d = material['q_d']
     a_d = material['a_d']
-    if q_d == 0 or a_d == 0:
-        return np.nan
-    dorn = sigma_d*(1.0 - np.sqrt(-1.0*R*temp/q_d*np.log(strain_rate/a_d)))
-    if dorn < 0.0:
-        dorn = 0
-    return dorn
+    # Zero-valued parameters mark a material without Dorn's law
+    q_d = np.where(np.equal(q_d, 0), np.nan, q_d)
+    a_d = np.where(np.equal(a_d, 0), np.nan, a_d)
+    return -1.0*R*np.asarray(temp)/q_d*np.log(strain_rate/a_d)
 
-def sigma_d(material, z, temp, strain_rate=None,
-            compute=None, mode=None):
+def _dorn_stress(material, term):
     """
-    Computes differential stress for a material at given depth, temperature
-    and strain rate. Returns the minimum of Byerlee's law, dislocation creep
-    or dorn's creep.
+    Dorn's law stress from the term returned by _dorn_term().
+    """
+    dorn = material['sigma_d']*(1.0 - np.sqrt(term))
+    # np.maximum would propagate NaN, which is what we want here
+    return np.maximum(dorn, 0.0)
+
+def sigma_creep(material, temp, strain_rate, compute=None):
+    """
+    Computes the differential stress of the creep processes at given
+    temperatures and strain rate. Where dislocation creep exceeds 200 MPa
+    and Dorn's law gives a positive stress, Dorn's law replaces dislocation
+    creep. Diffusion creep, if computed, acts in parallel to it.
 
-    Parametersq
+    Parameters
     ----------
-    material : dict
-        Dict containing material properties required by sigma_byerlee() and
-        sigma_dislocation()
-    z : float
-        Positive depth im m below surface
-    temp : float
+    material : np.void or dict
+        Material record or dict containing material properties required by
+        sigma_dislocation(), sigma_diffusion() and sigma_dorn()
+    temp : float or np.array
         Temperature in K
     strain_rate : float
-        Reference strain rate in 1/s. If `None` will use self.strain_rate
+        Reference strain rate in 1/s
     compute : list
         List of processes to compute: 'dislocation', 'diffusion', 'dorn'.
         Default is ['dislocation', 'dorn'].
-    mode : str
-        'compression' or 'extension'
 
     Returns
     -------
-    Sigma : float
-        Differential stress in Pa
+    sigma : np.array
+        Differential stress in Pa, NaN where no creep law applies
     """
-    if z < 0:
-        raise ValueError('Depth must be positive. Got z =', z)
-    if strain_rate is None:
-        e_prime = self.strain_rate
-    else:
-        e_prime = strain_rate
-
     compute_default = ['dislocation', 'dorn']
     if compute is None:
         compute = compute_default
     else:
         # Check the keywords
         for kwd in compute:
-            if kwd not in compute_default:
+            if kwd not in ['dislocation', 'diffusion', 'dorn']:
                 raise ValueError('Unknown compute keyword', kwd)
 
-    s_byerlee = sigma_byerlee(material, z, mode)
+    material = _as_material(material)
+    temp = np.asarray(temp, dtype=float)
+    s = dict()
+    if 'dislocation' in compute:
+        s['dislocation'] = sigma_dislocation(material, temp, strain_rate)
+    if 'dorn' in compute:
+        s['dorn'] = sigma_dorn(material, temp, strain_rate)
+    if 'diffusion' in compute:
+        s['diffusion'] = sigma_diffusion(material, temp, strain_rate)
+    return _combine_creep(s, np.shape(temp))
 
-    proplist = list(mat.keys())
-    if 'diffusion' in compute and 'a_f' in proplist:
-        s_diff = sigma_diffusion(material, temp, e_prime)
-    else:
-        s_diff = np.nan
+def _combine_creep(s, shape):
+    """
+    Combine the stresses of the processes in the dict s to the creep
+    strength as described in sigma_creep().
+    """
+    # Missing creep laws are NaN and drop out in np.fmin
+    s_creep = s.get('dislocation')
+    if s_creep is None:
+        s_creep = np.full(shape, np.nan)
+    if 'dorn' in s:
+        # Comparisons with NaN are False, so missing laws keep dislocation
+        with np.errstate(invalid='ignore'):
+            use_dorn = (s_creep > 200e6) & (s['dorn'] > 0)
+        s_creep = np.where(use_dorn, s['dorn'], s_creep)
+    if 'diffusion' in s:
+        s_creep = np.fmin(s_creep, s['diffusion'])
+    return s_creep
 
-    if 'dislocation' in compute and 'a_p' in proplist:
-        s_disloc = sigma_dislocation(material, temp, e_prime)
-    else:
-        s_disloc = np.nan
-    if 'dorn' in compute and 'sigma_d' in proplist:
-        s_dorn = sigma_dorn(material, temp, e_prime)
-    else:
-        s_dorn = np.nan
+class CreepTable:
+    """
+    Tabulated creep strength of a material over a regular grid of
+    temperature and log10 strain rate. Each creep process is tabulated
+    separately as a smooth function: the logarithm of the stress for
+    dislocation and diffusion creep, which is linear in log strain rate, and
+    the term under the root of Dorn's law, which is bilinear. Queries
+    interpolate the tables bilinearly and then combine the processes as
+    sigma_creep() does, so the switch to Dorn's law is not smeared over a
+    table cell. Points outside of the grid are computed exactly with
+    sigma_creep().
 
-    if (s_disloc > 200e6) and (s_dorn > 0):
-        s_creep = s_dorn
-    else:
-        s_creep = s_disloc
+    Parameters
+    ----------
+    material : np.void or dict
+        Material record as returned by materials()
+    t_min, t_max, dt : float
+        Temperature range and spacing of the table in K
+    log_e_min, log_e_max, dlog_e : float
+        Range and spacing of log10 strain rate in 1/s
+    compute : list
+        List of creep processes, see sigma_creep()
+
+    Attributes
+    ----------
+    error : float
+        Maximum relative interpolation error, measured at the centres of
+        the table cells
+    """
+
+    def __init__(self, material, t_min=273.0, t_max=1873.0, dt=0.1,
+                 log_e_min=-18.0, log_e_max=-12.0, dlog_e=0.1,
+                 compute=None):
+        self.material = _as_material(material)
+        self.compute = compute
+        self.nt = int(round((t_max - t_min)/dt)) + 1
+        self.ne = int(round((log_e_max - log_e_min)/dlog_e)) + 1
+        self.t_min = t_min
+        self.dt = (t_max - t_min)/(self.nt - 1)
+        self.log_e_min = log_e_min
+        self.dlog_e = (log_e_max - log_e_min)/(self.ne - 1)
+        temp = t_min + self.dt*np.arange(self.nt)
+        log_e = log_e_min + self.dlog_e*np.arange(self.ne)
+        self.tables = self._tabulate(temp[:, None], log_e[None, :])
+        # Compare with the exact values in the cell centres
+        temp_c = temp[:-1, None] + 0.5*self.dt
+        log_e_c = log_e[None, :-1] + 0.5*self.dlog_e
+        interp = self._combine(dict(
+            (k, 0.25*(tab[:-1, :-1] + tab[1:, :-1] + tab[:-1, 1:] +
+                      tab[1:, 1:])) for k, tab in self.tables.items()),
+            temp_c.shape[:1] + log_e_c.shape[1:])
+        with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+            exact = sigma_creep(self.material, temp_c, 10.0**log_e_c,
+                                compute=self.compute)
+            rel = np.abs(interp/exact - 1.0)
+        self.error = float(np.nanmax(rel)) if np.any(np.isfinite(rel)) \
+            else 0.0
+
+    def _tabulate(self, temp, log_e):
+        """
+        Smooth tables of the creep processes, see _combine().
+        """
+        compute = self.compute
+        if compute is None:
+            compute = ['dislocation', 'dorn']
+        material = self.material
+        strain_rate = 10.0**log_e
+        tables = dict()
+        with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+            if 'dislocation' in compute:
+                tables['dislocation'] = np.log(np.clip(
+                    sigma_dislocation(material, temp, strain_rate),
+                    1e-300, 1e300))
+            if 'diffusion' in compute:
+                tables['diffusion'] = np.log(np.clip(
+                    sigma_diffusion(material, temp, strain_rate),
+                    1e-300, 1e300))
+            if 'dorn' in compute:
+                tables['dorn'] = _dorn_term(material, temp, strain_rate)
+        return tables
+
+    def _combine(self, values, shape):
+        """
+        Creep strength from interpolated values of the tables.
+        """
+        s = dict()
+        with np.errstate(over='ignore', invalid='ignore'):
+            for k, v in values.items():
+                if k == 'dorn':
+                    s[k] = _dorn_stress(self.material, v)
+                else:
+                    s[k] = np.exp(v)
+        return _combine_creep(s, shape)
+
+    def __call__(self, temp, strain_rate):
+        """
+        Creep strength in Pa at temperatures temp (K) and strain rate
+        (1/s), which must be broadcastable against each other.
+        """
+        temp = np.asarray(temp, dtype=float)
+        log_e = np.log10(np.asarray(strain_rate, dtype=float))
+        ft = (temp - self.t_min)/self.dt
+        fe = (log_e - self.log_e_min)/self.dlog_e
+        it = np.clip(np.floor(ft).astype(int), 0, self.nt - 2)
+        wt = ft - it
+        ie = np.clip(np.floor(fe).astype(int), 0, self.ne - 2)
+        we = fe - ie
+        values = dict()
+        for k, tab in self.tables.items():
+            if log_e.ndim == 0:
+                # A single strain rate reduces the lookup to one dimension
+                col = (1.0 - we)*tab[:, ie] + we*tab[:, ie + 1]
+                values[k] = col[it] + wt*(col[it + 1] - col[it])
+            else:
+                values[k] = ((1.0 - wt)*((1.0 - we)*tab[it, ie] +
+                                         we*tab[it, ie + 1]) +
+                             wt*((1.0 - we)*tab[it + 1, ie] +
+                                 we*tab[it + 1, ie + 1]))
+        s = self._combine(values, np.broadcast(temp, log_e).shape)
+        outside = (wt < 0) | (wt > 1) | (fe < 0) | (fe > self.ne - 1)
+        if np.any(outside):
+            exact = sigma_creep(self.material, temp, 10.0**log_e,
+                                compute=self.compute)
+            s = np.where(outside, exact, s)
+        return s
+
+
+@lru_cache(maxsize=CREEP_TABLE_CACHE_SIZE)
+def _cached_creep_table(params, compute, grid):
+    material = dict((k, np.nan if v is None else v)
+                    for k, v in zip(PROPERTIES, params))
+    return CreepTable(material, compute=None if compute is None
+                      else list(compute), **dict(grid))
+
+
+def creep_table(material, compute=None, **grid):
+    """
+    Return the CreepTable of a material. Tables are cached by material
+    parameters and grid, the least recently used tables are dropped
+    once more than CREEP_TABLE_CACHE_SIZE exist.
+
+    Parameters
+    ----------
+    material : np.void or dict
+        Material record as returned by materials()
+    compute : list
+        List of creep processes, see sigma_creep()
+    grid : dict
+        Grid definition, see CreepTable
+
+    Returns
+    -------
+    table : CreepTable
+    """
+    material = _as_material(material)
+    # NaN never compares equal, use None as cache key for missing laws
+    params = tuple(None if np.isnan(material[prop]) else float(material[prop])
+                   for prop in PROPERTIES)
+    return _cached_creep_table(params,
+                               None if compute is None else tuple(compute),
+                               tuple(sorted(grid.items())))
 
-    return min([s_byerlee, s_creep, s_diff])
+
+def sigma_d(material, z, temp, strain_rate=None,
+            compute=None, mode=None):
+    """
+    Computes differential stress for a material at given depth, temperature
+    and strain rate. Returns the minimum of Byerlee's law, dislocation creep
+    or dorn's creep. Accepts scalars or arrays of equal shape for z and temp.
+
+    Parameters
+    ----------
+    material : np.void or dict
+        Material record or dict containing material properties required by
+        sigma_byerlee() and sigma_dislocation()
+    z : float or np.array
+        Positive depth im m below surface
+    temp : float or np.array
+        Temperature in K
+    strain_rate : float
+        Reference strain rate in 1/s
+    compute : list
+        List of processes to compute: 'dislocation', 'diffusion', 'dorn'.
+        Default is ['dislocation', 'dorn'].
+    mode : str
+        'compression' or 'extension'
+
+    Returns
+    -------
+    Sigma : float or np.array
+        Differential stress in Pa
+    """
+    if np.any(np.asarray(z) < 0):
+        raise ValueError('Depth must be positive. Got z =', z)
+    if strain_rate is None:
+        raise ValueError('A strain rate is required')
+
+    s_byerlee = sigma_byerlee(material, z, mode)
+    s_creep = sigma_creep(material, temp, strain_rate, compute=compute)
+    s = np.fmin(s_byerlee, s_creep)
+    if s.ndim == 0:
+        return float(s)
+    return s
 
 def print_mat_info(mat, ax=None):
     # make a pretty info plot on the materials
+    if isinstance(mat, dict):
+        mat = material_table([mat])[0]
     print('')
     print('###################################################################')
     print('Name             :', mat['name'])
@@ -741,8 +1099,9 @@ def print_mat_info(mat, ax=None):
     print('A_p     :', mat['a_p'])
     print('n       :', mat['n'])
     print('Q_p     :', mat['q_p'])
-    proplist = list(mat.keys())
-    if 'a_f' in proplist:
+    has_diff = not np.isnan(mat['a_f'])
+    has_dorn = not np.isnan(mat['sigma_d'])
+    if has_diff:
         print('')
         print('Diffusion creep properties')
         print('Source  :', mat['source_diff'])
@@ -750,7 +1109,7 @@ def print_mat_info(mat, ax=None):
         print('Q_f     :', mat['q_f'])
         print('a       :', mat['a'])
         print('m       :', mat['m'])
-    if 'sigma_d' in proplist:
+    if has_dorn:
         print('')
         print('Dorn\'s law properties')
         print('Source:', mat['source_dorn'])
@@ -767,9 +1126,9 @@ def print_mat_info(mat, ax=None):
         row_labels = ['name', 'source', 'via']
         row_labels.extend(props_byerlee)
         row_labels.extend(props_disloc)
-        if 'a_f' in proplist:
+        if has_diff:
             row_labels.extend(props_diff)
-        if 'sigma_d' in proplist:
+        if has_dorn:
             row_labels.extend(props_dorn)
         cell_text = []
         for prop in row_labels:
@@ -780,7 +1139,7 @@ def print_mat_info(mat, ax=None):
                              colWidths=None,
                              rowLabels=row_labels,
                              rowColours=None,
-                             rowLoc='Left',
+                             rowLoc='left',
                              colLabels=None,
                              colColours=None,
                              colLoc='center',
@@ -790,7 +1149,7 @@ def print_mat_info(mat, ax=None):
         thetable.set_fontsize('small')
         return thetable
 
-def compute_dsigma(mat, z, T, strain_rate):
+def compute_dsigma(mat, z, T, strain_rate, tabulated=False):
     """
     Compute differential stress for a given material at depths z and
     temperatures T. Comptues for both compression and extension and
@@ -798,14 +1157,17 @@ def compute_dsigma(mat, z, T, strain_rate):
 
     Parameters
     ----------
-    mat : dict
-        Dict of type as defined in def materials()
+    mat : np.void or dict
+        Material record as returned by materials()
     z : np.array
         1D array of increasing depth values in positive m
     T : np.array
         1D array of same shape as z with T in Kelvin
     strain_rate : float
         Strain rate in 1/s
+    tabulated : bool
+        Look up creep strength in the cached CreepTable of the material
+        instead of evaluating the creep laws
 
     Returns
     -------
@@ -814,26 +1176,174 @@ def compute_dsigma(mat, z, T, strain_rate):
     depths : np.array
         1D array with corresponding depth values
     """
-    s_d_c = np.empty_like(z)              # Diff. stress for compression
-    s_d_e = np.empty_like(z)              # Diff. stress for extension
-    for i in range(z.shape[0]):
-        s_d_c[i] = -1*sigma_d(mat, z[i], T[i], strain_rate=strain_rate,
-                              mode='compression')
-        s_d_e[i] = sigma_d(mat, z[i], T[i], strain_rate=strain_rate,
-                           mode='extension')
+    z = np.asarray(z, dtype=float)
+    if np.any(z < 0):
+        raise ValueError('Depth must be positive.')
+    # Creep does not depend on the mode, only Byerlee's law does
+    if tabulated:
+        s_creep = creep_table(mat)(T, strain_rate)
+    else:
+        s_creep = sigma_creep(mat, T, strain_rate)
+    s_d_c = -1*np.fmin(sigma_byerlee(mat, z, 'compression'), s_creep)
+    s_d_e = np.fmin(sigma_byerlee(mat, z, 'extension'), s_creep)
     dsigma = np.concatenate((s_d_c, s_d_e[::-1]))
     depths = np.concatenate((z, z[::-1]))
     return dsigma, depths
 
-if __name__ == "__main__":
-    mat_dbase = sorted(materials(), key=lambda k:k['name'] )
+def compute_dsigma_batch(mats, z, T, strain_rates, compute=None):
+    """
+    Compute differential stress for several materials and strain rates in
+    one vectorized pass. Output is arranged as in compute_dsigma(), i.e.
+    compression followed by extension along the last axis.
+
+    Parameters
+    ----------
+    mats : np.ndarray, list or dict
+        Material table as returned by materials(), list of material dicts,
+        or columnar arrays as returned by material_arrays()
+    z : np.array
+        1D array of increasing depth values in positive m
+    T : np.array
+        1D array of same shape as z with T in Kelvin
+    strain_rates : float or np.array
+        Strain rate(s) in 1/s
+    compute : list
+        List of creep processes, see sigma_creep()
+
+    Returns
+    -------
+    dsigma : np.array
+        Array of shape (N materials, M strain rates, 2*len(z)) with the
+        differential stress in Pa
+    depths : np.array
+        1D array with corresponding depth values
+    """
+    if not isinstance(mats, dict):
+        mats = material_arrays(mats)
+    z = np.asarray(z, dtype=float)
+    T = np.asarray(T, dtype=float)
+    if np.any(z < 0):
+        raise ValueError('Depth must be positive.')
+    # Broadcast to (material, strain rate, depth)
+    columns = dict((k, np.asarray(v, dtype=float)[:, None, None])
+                   for k, v in mats.items())
+    e_prime = np.atleast_1d(np.asarray(strain_rates, dtype=float))
+    e_prime = e_prime[None, :, None]
+    s_creep = sigma_creep(columns, T[None, None, :], e_prime,
+                          compute=compute)
+    shape = (len(columns['a_p']), e_prime.shape[1], z.shape[0])
+    s_d_c = -1*np.fmin(sigma_byerlee(columns, z, 'compression'), s_creep)
+    s_d_e = np.fmin(sigma_byerlee(columns, z, 'extension'), s_creep)
+    dsigma = np.concatenate((np.broadcast_to(s_d_c, shape),
+                             np.broadcast_to(s_d_e, shape)[:, :, ::-1]),
+                            axis=-1)
+    depths = np.concatenate((z, z[::-1]))
+    return dsigma, depths
 
-    geotherm = np.loadtxt('./McKenzieetal2005_Fig4_Geotherm.csv',
-                          skiprows=1, delimiter=',')
+DEFAULT_GEOTHERM = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'McKenzieetal2005_Fig4_Geotherm.csv')
+
+
+def read_geotherm(fname):
+    """
+    Read a geotherm from a CSV file with one header line and the columns
+    depth in km and temperature in degree Celsius.
+
+    Parameters
+    ----------
+    fname : str
+        File name
+
+    Returns
+    -------
+    geotherm : np.array
+        Array of structure [rows, 2] with depth in m and temperature in K
+    """
+    geotherm = np.loadtxt(fname, skiprows=1, delimiter=',', ndmin=2)
     geotherm[:, 0] *= 1000
     geotherm[:, 1] += 273
+    return geotherm
+
+
+def batch(fgeotherms, mats=None, strain_rates=1e-16, num_points=1000,
+          max_depth=100e3, outdir='.', fmt='npz', verbose=True):
+    """
+    Compute strength envelopes for many geotherms without the GUI and
+    write them to binary files named after the geotherm files.
+
+    Parameters
+    ----------
+    fgeotherms : list
+        List of geotherm files, see read_geotherm()
+    mats : np.ndarray
+        Material table, default is materials()
+    strain_rates : float or list
+        Strain rate(s) in 1/s
+    num_points : int
+        Number of depth samples
+    max_depth : float
+        Maximum depth in m
+    outdir : str
+        Output directory
+    fmt : str
+        'npz' writes dsigma, depths, materials and strain_rates to one
+        file per geotherm, 'npy' writes only the dsigma array
+    verbose : bool
+        Print the names of the written files
+
+    Returns
+    -------
+    fouts : list
+        Names of the written files
+    """
+    if fmt not in ['npz', 'npy']:
+        raise ValueError('Unknown output format:', fmt)
+    if mats is None:
+        mats = materials()
+    columns = material_arrays(mats)
+    strain_rates = np.atleast_1d(np.asarray(strain_rates, dtype=float))
+    zs = np.linspace(0, max_depth, num=num_points)
+    fouts = []
+    for fgeotherm in fgeotherms:
+        geotherm = read_geotherm(fgeotherm)
+        T = np.interp(zs, geotherm[:, 0], geotherm[:, 1])
+        dsigma, depths = compute_dsigma_batch(columns, zs, T, strain_rates)
+        name = os.path.splitext(os.path.basename(fgeotherm))[0]
+        fout = os.path.join(outdir, name + '.' + fmt)
+        if fmt == 'npz':
+            np.savez(fout, dsigma=dsigma, depths=depths,
+                     materials=mats['name'], strain_rates=strain_rates)
+        else:
+            np.save(fout, dsigma)
+        if verbose:
+            print(fout)
+        fouts.append(fout)
+    return fouts
+
+
+def explorer(fgeotherm=None, strain_rate=1e-16):
+    """
+    Interactive rheology explorer.
+
+    Parameters
+    ----------
+    fgeotherm : str
+        Geotherm file, see read_geotherm(). Default is the geotherm of
+        McKenzie et al. (2005), Fig. 4.
+    strain_rate : float
+        Initial strain rate in 1/s
+    """
+    # Matplotlib is only needed for the GUI and slow to import
+    import matplotlib as mpl
+    import matplotlib.pyplot as plt
+    import matplotlib.widgets
+
+    mat_dbase = np.sort(materials(), order='name')
+
+    if fgeotherm is None:
+        fgeotherm = DEFAULT_GEOTHERM
+    geotherm = read_geotherm(fgeotherm)
 
-    strain_rate = 1e-16
     num_points = 1000
 
     xmin = -2.5
@@ -863,24 +1373,70 @@ if __name__ == "__main__":
     ax_table.set_axis_off()
     fig.add_subplot(ax_table)
 
-    labels = []
     lines = []
-    matlist = []
     labeld = dict()
 
     # Plot a vertical line at 0GPa
     ax.plot([0,0], [ymin, ymax], lw=1, c='black', alpha=0.5)
 
-    n=0 # For colours
-    nmax=len(mat_dbase)
-    for mat in mat_dbase:
-        matlist.append(mat)
+    # Envelopes are only computed for visible lines and cached by strain
+    # rate and material index. Only the ENVELOPE_CACHE_SIZE most recently
+    # used strain rates are kept. The lines, legend lines and the material
+    # table are animated and drawn with blitting.
+    mat_columns = material_arrays(mat_dbase)
+    z_plot = np.concatenate((zs, zs[::-1]))
+    envelopes = OrderedDict()
+    line_rates = dict()
+    state = dict(strain_rate=strain_rate, background=None, table=None)
+    nmax = len(mat_dbase)
+    empty = np.full(z_plot.shape, np.nan)
+    for n, mat in enumerate(mat_dbase):
         label = mat['name'] + ', ' + mat['source']
         labeld[label] = n
         c = plt.cm.nipy_spectral(n*1.0/nmax)   # Colour index
-        sigma_plot, z_plot = compute_dsigma(mat, zs, T, strain_rate)
-        lines.append(ax.plot(sigma_plot/1e9, z_plot/1000, label=label, c=c)[0])
-        n+=1
+        lines.append(ax.plot(empty, z_plot/1000, label=label, c=c,
+                             animated=True)[0])
+
+    def update_lines(indices):
+        # Bring the given lines up to date with the current strain rate
+        rate = state['strain_rate']
+        cache = envelopes.pop(rate, dict())
+        envelopes[rate] = cache
+        while len(envelopes) > ENVELOPE_CACHE_SIZE:
+            envelopes.popitem(last=False)
+        missing = [i for i in indices if i not in cache]
+        if missing:
+            columns = dict((k, v[missing]) for k, v in mat_columns.items())
+            sigma_plots = compute_dsigma_batch(columns, zs, T, rate)[0]
+            for i, sigma_plot in zip(missing, sigma_plots[:, 0]):
+                cache[i] = sigma_plot*1e-9
+        for i in indices:
+            if line_rates.get(i) != rate:
+                lines[i].set_xdata(cache[i])
+                line_rates[i] = rate
+
+    def animated_artists():
+        artists = [line for line in lines if line.get_visible()]
+        artists.extend(leg.get_lines())
+        if state['table'] is not None:
+            artists.append(state['table'])
+        return artists
+
+    def on_draw(event):
+        # Full redraws store the static background for blitting
+        state['background'] = fig.canvas.copy_from_bbox(fig.bbox)
+        for artist in animated_artists():
+            fig.draw_artist(artist)
+
+    def blit():
+        if state['background'] is None:
+            fig.canvas.draw_idle()
+            return
+        fig.canvas.restore_region(state['background'])
+        for artist in animated_artists():
+            fig.draw_artist(artist)
+        fig.canvas.blit(fig.bbox)
+        fig.canvas.flush_events()
 
     ax.set_xlabel('Strength / GPa')
     ax.set_ylabel('Depth / km')
@@ -897,22 +1453,22 @@ if __name__ == "__main__":
 
     # Make the buttons and input box
     def submit(text):
-        strain_rate = float(text)
-        print('Recomputing strength for strain rate', strain_rate)
-        for i in range(len(lines)):
-            mat = matlist[i]
-            sigma_plot, z_plot = compute_dsigma(mat, zs, T, strain_rate)
-            lines[i].set_xdata(sigma_plot*1e-9)
-        plt.draw()
+        state['strain_rate'] = float(text)
+        visible = [i for i, line in enumerate(lines) if line.get_visible()]
+        print('Recomputing strength for strain rate', state['strain_rate'])
+        update_lines(visible)
+        blit()
     axbox = plt.axes([0.8, 0.8, 0.1, 0.05])
-    text_box = mpl.widgets.TextBox(axbox, 'Strain rate', initial='1e-16')
+    text_box = mpl.widgets.TextBox(axbox, 'Strain rate',
+                                   initial=str(strain_rate))
     text_box.on_submit(submit)
     # Make a toggle all on button
     def toggle_all_on(event):
+        update_lines(range(len(lines)))
         for legline, origline in zip(leg.get_lines(), lines):
             origline.set_visible(True)
             legline.set_alpha(1.0)
-        fig.canvas.draw()
+        blit()
     ax_all_on = plt.axes([0.8, 0.75, 0.1, 0.05])
     button_all_on = mpl.widgets.Button(ax_all_on, 'Show all')
     button_all_on.on_clicked(toggle_all_on)
@@ -921,7 +1477,7 @@ if __name__ == "__main__":
         for legline, origline in zip(leg.get_lines(), lines):
             origline.set_visible(False)
             legline.set_alpha(0.2)
-        fig.canvas.draw()
+        blit()
     ax_all_off = plt.axes([0.8, 0.7, 0.1, 0.05])
     button_all_off = mpl.widgets.Button(ax_all_off, 'Hide all')
     button_all_off.on_clicked(toggle_all_off)
@@ -970,6 +1526,7 @@ if __name__ == "__main__":
         legline_picker=int(0.5*legline_width)
         legline.set_linewidth(legline_width)
         legline.set_picker(legline_picker) # 5pts tolerance
+        legline.set_animated(True)
         lined[legline] = origline
         origline.set_visible(False)
         legline.set_alpha(0.2)
@@ -977,34 +1534,31 @@ if __name__ == "__main__":
     def onpick_legend(event):
         # on the pick event, find the orig line corresponding to the
         # legend proxy line, and toggle the visibility
-        global the_table
         legline = event.artist
         origline = lined[legline]
         vis = not origline.get_visible()
+        mat_idx = labeld[origline.get_label()]
+        if vis:
+            update_lines([mat_idx])
         origline.set_visible(vis)
+        if state['table'] is not None:
+            state['table'].remove()
+            state['table'] = None
         # Change the alpha on the line in the legend so we can see what lines
         # have been toggled
         if vis:
             legline.set_alpha(1.0)
             # Also print info
-            mat_idx = labeld[origline.get_label()]
-            if 'the_table' in globals():
-                print('deleting table')
-                the_table.remove()
-                del the_table
-                fig.canvas.draw()
-            the_table = print_mat_info(mat_dbase[mat_idx], ax_table)
+            state['table'] = print_mat_info(mat_dbase[mat_idx], ax_table)
+            state['table'].set_animated(True)
         else:
-            if 'the_table' in globals():
-                print('deleting table')
-                the_table.remove()
-                del the_table
-                fig.canvas.draw()
             legline.set_alpha(0.2)
-        fig.canvas.draw()
+        blit()
 
     fig.canvas.mpl_connect('pick_event', onpick_legend)
-    fig.canvas.set_window_title('Rheology explorer')
+    fig.canvas.mpl_connect('draw_event', on_draw)
+    if fig.canvas.manager is not None:
+        fig.canvas.manager.set_window_title('Rheology explorer')
     plt.subplots_adjust(top=0.925,
                         bottom=0.07,
                         left=0.065,
@@ -1018,3 +1572,57 @@ if __name__ == "__main__":
     #figManager = plt.get_current_fig_manager()
     #figManager.window.showMaximized()
     plt.show()
+
+
+def main(argv=None):
+    """
+    Command line interface. Without arguments the interactive explorer is
+    started, with --batch envelopes are written to binary files.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Explore and compute yield strength envelopes.')
+    parser.add_argument('--batch', metavar='DIR',
+                        help='Compute envelopes for all *.csv geotherms in '
+                        'DIR without GUI')
+    parser.add_argument('--geotherm', help='Geotherm for the explorer')
+    parser.add_argument('-o', '--outdir', default='.',
+                        help='Output directory (default: .)')
+    parser.add_argument('-f', '--format', default='npz',
+                        choices=['npz', 'npy'], help='Output format')
+    parser.add_argument('-e', '--strain-rate', type=float, nargs='+',
+                        default=[1e-16], help='Strain rate(s) in 1/s')
+    parser.add_argument('-m', '--materials', nargs='+',
+                        help='Material names (default: all)')
+    parser.add_argument('-l', '--library',
+                        help='Material library (CSV or JSON)')
+    parser.add_argument('-n', '--num-points', type=int, default=1000,
+                        help='Number of depth samples')
+    parser.add_argument('-z', '--max-depth', type=float, default=100.0,
+                        help='Maximum depth in km')
+    args = parser.parse_args(argv)
+
+    if args.batch is None:
+        explorer(args.geotherm, args.strain_rate[0])
+        return
+    if args.library:
+        mats = load_materials(args.library)
+    else:
+        mats = materials()
+    if args.materials:
+        unknown = set(args.materials) - set(mats['name'])
+        if unknown:
+            parser.error('Unknown materials: ' + ', '.join(sorted(unknown)))
+        mats = mats[np.isin(mats['name'], args.materials)]
+    import glob
+    fgeotherms = sorted(glob.glob(os.path.join(args.batch, '*.csv')))
+    if not fgeotherms:
+        parser.error('No *.csv geotherms found in ' + args.batch)
+    if not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+    batch(fgeotherms, mats, args.strain_rate, args.num_points,
+          args.max_depth*1000, args.outdir, args.format)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+################################################################################
+#                     Copyright (C) 2019 by Christian Meessen                  #
+#                                                                              #
+#                         This file is part of Scripts                         #
+#                                                                              #
+#        Scripts is free software: you can redistribute it and/or modify       #
+#     it under the terms of the GNU General Public License as published by     #
+#           the Free Software Foundation version 3 of the License.             #
+#                                                                              #
+#      GMTScripts is distributed in the hope that it will be useful, but       #
+#          WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU       #
+#                   General Public License for more details.                   #
+#                                                                              #
+#      You should have received a copy of the GNU General Public License       #
+#       along with Scripts. If not, see <http://www.gnu.org/licenses/>.        #
+################################################################################
+"""
+Monte Carlo sweeps over material parameters of rheology_explorer.
+
+The samples are split into blocks that are computed by a pool of worker
+processes. Depth, temperature and parameter samples are placed in shared
+memory once, and every worker writes its block of envelopes directly into an
+.npy file on disk, so neither inputs nor results are pickled between
+processes.
+"""
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from rheology_explorer import PROPERTIES, compute_dsigma_batch
+
+# Per-process state of the workers, set by _init_worker()
+_worker = dict()
+
+
+def sample_parameters(material, nsamples, spread=None, seed=None):
+    """
+    Draw random material parameters around the values of a material.
+
+    Parameters
+    ----------
+    material : np.void or dict
+        Material record as returned by materials()
+    nsamples : int
+        Number of samples
+    spread : dict
+        Standard deviation for each parameter that shall be varied. a_p is
+        varied log-normally and its spread is given in log10 units, all
+        other parameters are normally distributed with the spread relative
+        to their value. Default is dict(a_p=0.5, n=0.05, q_p=0.05, f_p=0.1)
+    seed : int
+        Seed of the random number generator
+
+    Returns
+    -------
+    samples : dict
+        Dict of 1D arrays of length nsamples
+    """
+    if spread is None:
+        spread = dict(a_p=0.5, n=0.05, q_p=0.05, f_p=0.1)
+    rng = np.random.default_rng(seed)
+    samples = dict()
+    for prop, sd in spread.items():
+        value = float(material[prop])
+        if prop == 'a_p':
+            samples[prop] = value*10.0**rng.normal(0.0, sd, nsamples)
+        else:
+            samples[prop] = value*(1.0 + rng.normal(0.0, sd, nsamples))
+    return samples
+
+
+def _attach(name, shape):
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=float, buffer=shm.buf)
+
+
+def _init_worker(profile, samples, keys, material, strain_rate, fout):
+    """
+    Attach the shared arrays and open the result file once per worker.
+    """
+    _worker['profile'] = _attach(*profile)
+    _worker['samples'] = _attach(*samples)
+    _worker['keys'] = keys
+    _worker['material'] = material
+    _worker['strain_rate'] = strain_rate
+    _worker['out'] = np.load(fout, mmap_mode='r+')
+
+
+def _compute_block(start, stop):
+    """
+    Compute the envelopes of samples start:stop and write them to the
+    result file.
+    """
+    z, T = _worker['profile'][1]
+    samples = _worker['samples'][1]
+    material = _worker['material']
+    n = stop - start
+    columns = dict((prop, np.full(n, material[prop]))
+                   for prop in PROPERTIES)
+    for i, prop in enumerate(_worker['keys']):
+        columns[prop] = samples[i, start:stop]
+    dsigma = compute_dsigma_batch(columns, z, T, _worker['strain_rate'])[0]
+    out = _worker['out']
+    out[start:stop] = dsigma[:, 0, :]
+    out.flush()
+    return start, stop
+
+
+def _share(arr):
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    np.ndarray(arr.shape, dtype=float, buffer=shm.buf)[:] = arr
+    return shm
+
+
+def run_sweep(material, samples, z, T, strain_rate, fout, workers=None,
+              block=1000, dtype=np.float32, verbose=True):
+    """
+    Compute strength envelopes for every parameter sample in parallel.
+
+    Parameters
+    ----------
+    material : np.void or dict
+        Material record with the parameters that are not varied
+    samples : dict
+        Dict of 1D arrays of equal length with the varied parameters, see
+        sample_parameters()
+    z : np.array
+        1D array of increasing depth values in positive m
+    T : np.array
+        1D array of same shape as z with T in Kelvin
+    strain_rate : float
+        Strain rate in 1/s
+    fout : str
+        Name of the .npy file the envelopes are written to
+    workers : int
+        Number of worker processes, default is the number of CPUs
+    block : int
+        Number of samples computed by a worker at a time
+    dtype : np.dtype
+        Data type of the result file
+    verbose : bool
+        Print progress
+
+    Returns
+    -------
+    dsigma : np.memmap
+        Memory mapped array of shape (nsamples, 2*len(z)) with the envelopes
+        as computed by compute_dsigma()
+    depths : np.array
+        1D array with corresponding depth values
+    """
+    keys = list(samples.keys())
+    for prop in keys:
+        if prop not in PROPERTIES:
+            raise ValueError('Unknown material property', prop)
+    values = np.array([samples[prop] for prop in keys], dtype=float)
+    nsamples = values.shape[1]
+    z = np.asarray(z, dtype=float)
+    profile = np.array([z, np.asarray(T, dtype=float)])
+    material = dict((prop, float(material[prop])) for prop in PROPERTIES)
+
+    out = np.lib.format.open_memmap(fout, mode='w+', dtype=dtype,
+                                    shape=(nsamples, 2*z.shape[0]))
+    del out
+
+    shm_profile = _share(profile)
+    shm_samples = _share(values)
+    try:
+        initargs = ((shm_profile.name, profile.shape),
+                    (shm_samples.name, values.shape),
+                    keys, material, strain_rate, fout)
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_worker,
+                                 initargs=initargs) as pool:
+            futures = [pool.submit(_compute_block, i,
+                                   min(i + block, nsamples))
+                       for i in range(0, nsamples, block)]
+            done = 0
+            for future in as_completed(futures):
+                start, stop = future.result()
+                done += stop - start
+                if verbose:
+                    print('> {:d} / {:d} samples'.format(done, nsamples))
+    finally:
+        for shm in [shm_profile, shm_samples]:
+            shm.close()
+            shm.unlink()
+    return np.load(fout, mmap_mode='r'), np.concatenate((z, z[::-1]))
@@ -1,113 +1,492 @@
-"""
-List of useful functions
-"""
-
-import numpy as np
-import sys, os, platform, inspect
-
-class AK135:
-
-    def __init__(self):
-        self.data = None
-        self.__load_csv__()
-
-    def __load_csv__(self):
-        OS = platform.system()
-        if OS == 'Windows':
-            FolderSep = '\\'
-        else:
-            FolderSep = '/'
-        PyFile = inspect.getfile(inspect.currentframe())
-        PyPath = os.path.dirname(os.path.abspath(PyFile))
-        ModelFile = PyPath + FolderSep + 'AK135.csv'
-        self.data = np.loadtxt(ModelFile, delimiter=';', comments='#')
-        self.datacolumns = {
-            'depth': 0,
-            'density': 1,
-            'vp': 2,
-            'vs': 3,
-            'qkappa': 4,
-            'qmu': 5
-        }
-
-    def __call__(self, z):
-        data = self.data
-        depths = data[:, 0]
-        values = dict()
-        values['density'] = np.interp(z, depths, data[:, 1])
-        values['vp'] = np.interp(z, depths, data[:, 2])
-        values['vs'] = np.interp(z, depths, data[:, 3])
-        values['qkappa'] = np.interp(z, depths, data[:, 4])
-        values['qmu'] = np.interp(z, depths, data[:, 5])
-        values['pressure'] = self.pressure(z)
-        return values
-
-    def pressure(self, z):
-        """
-        Compute the pressure at depth z by integrating AK135.
-        Paramters:
-
-        * z : float
-            Depth in km where properties shall be calculated
-
-        Returns:
-
-        * pressure : float
-            The pressure at depth z in GPa.
-        """
-        g = 9.81
-        depths = self.data[:, 0]
-        depths_sample = np.append(depths[depths < z], z)
-        rhos = self.data[:, 1]
-        rho_z = np.interp(z, depths, self.data[:, 1])
-        rhos_sample = np.append(rhos[0:depths_sample.shape[0]-1], rho_z)
-        return g*np.trapz(rhos_sample, depths_sample)/1000.
-
-
-def read_args():
-    """
-    How to read and handle command line arguments
-    """
-    if len(sys.argv) < 2:
-      print("Error: not enough arguments!")
-      print("Usage: AK135 depth")
-      print("\nDepth in km")
-      sys.exit()
-    try:
-        arg1 = float(sys.argv[1])
-    except ValueError:
-        print("\nError: Input must be point-separated float.\n")
-        sys.exit()
-    return arg1
-
-def compute(depth):
-    """
-    Return Pressure from AK135 at given depth.
-    Depth range: 18 to 310km
-    AK135: http://rses.anu.edu.au/seismology/ak135/ak135f.html
-
-    Parameters:
-
-    * depth : float
-        Depth in km where the pressure should be calculated
-
-    Return:
-
-    * Pressure : float
-        Pressure at depth in Pa
-    """
-    model = AK135()
-    result = model(depth)
-    print()
-    print("Depth   : {:10.4f} km  ".format(depth))
-    print("Density : {:10.4f} t/m3".format(result['density']))
-    print("Vp      : {:10.4f} km/s".format(result['vp']))
-    print("Vs      : {:10.4f} km/s".format(result['vs']))
-    print("Qkappa  : {:10.4f}     ".format(result['qkappa']))
-    print("Qmu     : {:10.4f}     ".format(result['qmu']))
-    print("Pressure: {:10.4f} GPa ".format(result['pressure']))
-    print()
-
-
-if __name__ == "__main__":
-    compute(read_args())
+"""
+List of useful functions
+"""
+
+import numpy as np
+import sys, os, threading, itertools, argparse
+
+MODEL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'AK135.csv')
+
+# Loaded model tables by (file name, modification time, size)
+_model_cache = dict()
+# Integrated mass and pressure profiles by (id of the table, spherical)
+_profile_cache = dict()
+_cache_lock = threading.Lock()
+
+
+def _read_table(fname, st):
+    """
+    Read a model table from a CSV file. A binary copy is kept next to it
+    in fname.npz together with the size and modification time of the CSV
+    and used instead as long as both are unchanged.
+    """
+    fbin = fname + '.npz'
+    stamp = np.array([st.st_size, st.st_mtime_ns], dtype=np.int64)
+    try:
+        with np.load(fbin) as cached:
+            if np.array_equal(cached['stamp'], stamp):
+                return cached['data']
+    except (OSError, ValueError, KeyError):
+        pass
+    data = np.loadtxt(fname, delimiter=';', comments='#')
+    try:
+        # Write to a temporary file first so that concurrent readers never
+        # see a partial file
+        ftmp = '{}.{}.tmp'.format(fbin, os.getpid())
+        with open(ftmp, 'wb') as f:
+            np.savez(f, data=data, stamp=stamp)
+        os.replace(ftmp, fbin)
+    except OSError:
+        pass
+    return data
+
+
+def load_model(fname=MODEL_FILE):
+    """
+    Return the table of a reference model. Tables are parsed once per
+    process and reloaded when the file changes. The returned array is
+    read-only and shared between all callers.
+
+    Parameters:
+
+    * fname : str
+        CSV file with the columns depth, density, vp, vs, qkappa and qmu
+
+    Returns:
+
+    * data : numpy array
+        Array of structure [rows, columns]
+    """
+    fname = os.path.abspath(fname)
+    st = os.stat(fname)
+    key = (fname, st.st_mtime_ns, st.st_size)
+    with _cache_lock:
+        data = _model_cache.get(key)
+        if data is None:
+            data = _read_table(fname, st)
+            data.flags.writeable = False
+            _model_cache[key] = data
+    return data
+
+
+# Columns of the model tables
+COLUMNS = ['depth', 'density', 'vp', 'vs', 'qkappa', 'qmu']
+
+# Properties served by ReferenceModel
+PROPERTIES = COLUMNS[1:] + ['pressure', 'gravity']
+
+# Registered reference models by name as (file name, spherical)
+MODELS = dict(
+    ak135=(MODEL_FILE, True),
+    prem=(os.path.join(os.path.dirname(MODEL_FILE), 'PREM.csv'), True),
+    iasp91=(os.path.join(os.path.dirname(MODEL_FILE), 'IASP91.csv'), True)
+)
+
+
+def register_model(name, fname, spherical=True):
+    """
+    Register a reference model table under a name for get_model().
+
+    Parameters:
+
+    * name : str
+        Name of the model, case-insensitive
+    * fname : str
+        CSV file with the columns depth, density, vp, vs, qkappa and qmu.
+        First-order discontinuities are given as two rows of equal depth.
+    * spherical : bool
+        Default of get_model() for the gravity of the model, see
+        ReferenceModel. Must be False for tables that do not reach the
+        centre of the Earth, e.g. regional or crustal models.
+    """
+    MODELS[name.lower()] = (os.path.abspath(fname), spherical)
+
+
+def get_model(name, spherical=None):
+    """
+    Return the registered reference model of the given name.
+
+    Parameters:
+
+    * name : str
+        Name of the model, e.g. 'ak135', 'prem' or 'iasp91'
+    * spherical : bool
+        Gravity of the model, see ReferenceModel. None uses the value given
+        to register_model().
+
+    Returns:
+
+    * model : ReferenceModel
+    """
+    try:
+        fname, default = MODELS[name.lower()]
+    except KeyError:
+        raise ValueError('Unknown reference model', name)
+    if spherical is None:
+        spherical = default
+    return ReferenceModel(fname, spherical)
+
+
+class ReferenceModel:
+    """
+    1D Earth reference model given as a table of nodes that is linear in
+    between. First-order discontinuities are two rows of equal depth, and a
+    depth exactly on a discontinuity gets the values below it.
+
+    Gravity is computed from the mass enclosed at each radius of a
+    spherical Earth and pressure by integrating density times this gravity
+    from the surface. Both are exact within the piecewise linear density
+    up to the accuracy of the quadrature.
+
+    Parameters:
+
+    * fname : str
+        CSV file with the columns depth, density, vp, vs, qkappa and qmu
+    * spherical : bool
+        Use the self-consistent gravity of a spherical Earth. This requires
+        a table over the full depth range from the surface to the centre of
+        the Earth at 6371 km, otherwise a ValueError is raised. If False,
+        gravity is the constant g as in earlier versions, which also works
+        for tables of parts of the Earth.
+    """
+
+    # Gravitational constant in m3/(kg s2)
+    G = 6.674e-11
+    # Constant gravity in m/s2 if spherical is False
+    g = 9.81
+    # Radius of the Earth in km
+    radius = 6371.0
+    # Gauss-Legendre points and weights on [0, 1] for the pressure integral
+    _gauss_x, _gauss_w = np.polynomial.legendre.leggauss(4)
+    _gauss_x = 0.5*(_gauss_x + 1.0)
+    _gauss_w = 0.5*_gauss_w
+
+    def __init__(self, fname, spherical=True):
+        self.fname = fname
+        self.spherical = spherical
+        self.data = load_model(fname)
+        self.datacolumns = dict((c, i) for i, c in enumerate(COLUMNS))
+        if spherical and abs(self.data[-1, 0] - self.radius) > 1e-6:
+            raise ValueError('Model does not reach the centre of the Earth, '
+                             'use spherical=False', self.data[-1, 0])
+        key = (id(self.data), spherical)
+        with _cache_lock:
+            profile = _profile_cache.get(key)
+        if profile is None:
+            profile = self.__integrate__()
+            with _cache_lock:
+                # The table is kept as well so that its id is not reused
+                _profile_cache[key] = profile
+        self.data, self.mass_nodes, self.pressure_nodes = profile
+
+    def __integrate__(self):
+        """
+        Precompute the enclosed mass and the pressure at the model nodes.
+        """
+        depths = self.data[:, 0]
+        n = len(depths)
+        if self.spherical:
+            i = np.arange(n - 1)
+            # Mass of every layer, summed up from the centre
+            dM = self._layer_mass(i, self.radius - depths[1:])
+            self.mass_nodes = np.concatenate(
+                (np.cumsum(dM[::-1])[::-1], [0.0]))
+        else:
+            self.mass_nodes = None
+        i = np.arange(n - 1)
+        dP = self._pressure_increment(i, np.diff(depths))
+        self.pressure_nodes = np.concatenate(([0.0], np.cumsum(dP)))
+        return self.data, self.mass_nodes, self.pressure_nodes
+
+    def _slope(self, i):
+        """
+        Density gradient of layer i in g/cm3/km, zero at discontinuities.
+        """
+        depths = self.data[:, 0]
+        rhos = self.data[:, 1]
+        dz = depths[i+1] - depths[i]
+        return np.divide(rhos[i+1] - rhos[i], dz, out=np.zeros(np.shape(dz)),
+                         where=dz > 0)
+
+    def _layer_mass(self, i, r):
+        """
+        Mass in kg of layer i between radius r and the top of the layer,
+        integrated analytically for the linear density.
+        """
+        r_top = self.radius - self.data[i, 0]
+        # rho(r) = a + b*r in kg/m3 with r in km
+        b = -1000.*self._slope(i)
+        a = 1000.*self.data[i, 1] - b*r_top
+        def F(r):
+            return a*r**3/3. + b*r**4/4.
+        return 4*np.pi*(F(r_top) - F(r))*1e9
+
+    def _gravity(self, i, dz):
+        """
+        Gravity in m/s2 at distance dz in km below node i.
+        """
+        if not self.spherical:
+            return np.full(np.shape(dz), self.g)
+        depths = self.data[:, 0]
+        r = self.radius - depths[i] - dz
+        mass = self.mass_nodes[i] - self._layer_mass(i, r)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            g = self.G*mass/(r*1000.)**2
+        return np.where(r > 0, g, 0.0)
+
+    def _pressure_increment(self, i, dz):
+        """
+        Pressure increase in GPa over dz km below node i, integrated with
+        Gauss-Legendre quadrature.
+        """
+        rho_i = self.data[i, 1]
+        slope = self._slope(i)
+        dP = 0.0
+        for x, w in zip(self._gauss_x, self._gauss_w):
+            rho = rho_i + slope*x*dz
+            dP = dP + w*rho*self._gravity(i, x*dz)
+        return dP*dz/1000.
+
+    def locate(self, z):
+        """
+        Find the layer of every depth and the position within it.
+
+        Parameters:
+
+        * z : float or numpy array
+            Depth in km, values outside of the model are clipped
+
+        Returns:
+
+        * i : numpy array of int
+            Index of the node at the top of the layer
+        * w : numpy array
+            Relative position of z between node i and i+1
+        * dz : numpy array
+            Distance of z from node i in km
+        """
+        depths = self.data[:, 0]
+        z = np.clip(np.asarray(z, dtype=float), depths[0], depths[-1])
+        # Index of the last node above z. At first-order discontinuities
+        # this is the lower of the two nodes, so the layer has finite
+        # thickness.
+        i = np.clip(np.searchsorted(depths, z, side='right') - 1, 0,
+                    len(depths) - 2)
+        dz = z - depths[i]
+        w = dz/(depths[i+1] - depths[i])
+        return i, w, dz
+
+    def __call__(self, z, properties=None):
+        """
+        Compute several properties at depth z in one pass.
+
+        Parameters:
+
+        * z : float or numpy array
+            Depth in km where properties shall be calculated
+        * properties : list of str
+            Any of PROPERTIES, default is all of them
+
+        Returns:
+
+        * values : dict
+            The properties at depth z as float or numpy array. Density in
+            g/cm3, velocities in km/s, pressure in GPa and gravity in m/s2.
+        """
+        if properties is None:
+            properties = PROPERTIES
+        for name in properties:
+            if name not in PROPERTIES:
+                raise ValueError('Unknown property', name)
+        i, w, dz = self.locate(z)
+        cols = [self.datacolumns[name] for name in COLUMNS[1:]
+                if name in properties]
+        cols = np.array(cols, dtype=int)
+        top = self.data[i[..., None], cols]
+        bottom = self.data[i[..., None] + 1, cols]
+        interp = top + (bottom - top)*w[..., None]
+        values = dict()
+        for k, c in enumerate(cols):
+            values[COLUMNS[c]] = interp[..., k]
+        if 'pressure' in properties:
+            values['pressure'] = (self.pressure_nodes[i] +
+                                  self._pressure_increment(i, dz))
+        if 'gravity' in properties:
+            values['gravity'] = self._gravity(i, dz)
+        values = dict((name, values[name]) for name in properties)
+        if i.ndim == 0:
+            values = dict((name, float(v)) for name, v in values.items())
+        return values
+
+    def pressure(self, z):
+        """
+        Compute the pressure at depth z by integrating the density.
+        Paramters:
+
+        * z : float or numpy array
+            Depth in km where properties shall be calculated
+
+        Returns:
+
+        * pressure : float or numpy array
+            The pressure at depth z in GPa.
+        """
+        return self(z, ['pressure'])['pressure']
+
+    def gravity(self, z):
+        """
+        Return the gravitational acceleration at depth z in m/s2.
+        """
+        return self(z, ['gravity'])['gravity']
+
+
+class AK135(ReferenceModel):
+
+    def __init__(self):
+        ReferenceModel.__init__(self, MODEL_FILE)
+
+
+def stream(fin, fout, model=None, column=0, properties=None,
+           chunksize=100000, fmt='%.6f'):
+    """
+    Annotate a table of depths with model properties. The input is read
+    and written in chunks of rows, so memory use does not depend on the
+    length of the input.
+
+    Parameters:
+
+    * fin : file object
+        Whitespace separated table with depths in km. Lines starting with #
+        are skipped.
+    * fout : file object
+        Output, every input row is copied unchanged with the properties
+        appended
+    * model : ReferenceModel
+        Model to use, default is AK135
+    * column : int
+        Column of fin that holds the depth
+    * properties : list of str
+        Properties to append, default is all of PROPERTIES
+    * chunksize : int
+        Number of rows processed at a time
+    * fmt : str
+        Format of the property values
+
+    Returns:
+
+    * nrows : int
+        Number of rows written
+    """
+    if model is None:
+        model = AK135()
+    if properties is None:
+        properties = PROPERTIES
+    fout.write('# depth column {:d}, appended: {}\n'.format(
+        column, ' '.join(properties)))
+    nrows = 0
+    while True:
+        lines = list(itertools.islice(fin, chunksize))
+        if not lines:
+            break
+        lines = [l for l in lines if l.strip() and not l.lstrip()
+                 .startswith('#')]
+        if not lines:
+            continue
+        table = np.loadtxt(lines, ndmin=2)
+        values = model(table[:, column], properties)
+        out = np.column_stack([values[p] for p in properties])
+        # The input text is copied unchanged, only the appended properties
+        # are formatted, all at once instead of row by row
+        row = ' '.join([fmt]*len(properties))
+        appended = ((row + '\n')*out.shape[0] % tuple(out.ravel())).split('\n')
+        fout.writelines(l.strip() + ' ' + a + '\n'
+                        for l, a in zip(lines, appended))
+        nrows += out.shape[0]
+    return nrows
+
+
+def read_args(argv=None):
+    """
+    How to read and handle command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description='Properties of a 1D Earth reference model at a depth or '
+        'for a table of depths.')
+    parser.add_argument('depth', nargs='?', type=float,
+                        help='Depth in km')
+    parser.add_argument('-f', '--file', help='Table with depths in km to '
+                        'annotate, - for stdin')
+    parser.add_argument('-c', '--column', type=int, default=0,
+                        help='Column of the depths in the table (default: 0)')
+    parser.add_argument('-o', '--output', help='Output file (default: stdout)')
+    parser.add_argument('-p', '--properties', default=','.join(PROPERTIES),
+                        help='Comma separated properties to append '
+                        '(default: all)')
+    parser.add_argument('-m', '--model', default='ak135',
+                        help='Reference model: ' + ', '.join(MODELS) +
+                        ' or a CSV file')
+    parser.add_argument('-g', '--constant-g', action='store_true',
+                        help='Use constant gravity instead of the gravity '
+                        'of a spherical Earth, required for models that do '
+                        'not reach the centre of the Earth')
+    parser.add_argument('--chunksize', type=int, default=100000,
+                        help='Rows processed at a time (default: 100000)')
+    args = parser.parse_args(argv)
+    if (args.depth is None) == (args.file is None):
+        parser.error('give either a depth or a table with -f')
+    return args
+
+def compute(depth, model=None):
+    """
+    Print the properties of a reference model at given depth.
+    AK135: http://rses.anu.edu.au/seismology/ak135/ak135f.html
+
+    Parameters:
+
+    * depth : float
+        Depth in km where the properties should be calculated
+    * model : ReferenceModel
+        Model to use, default is AK135
+    """
+    if model is None:
+        model = AK135()
+    result = model(depth)
+    print()
+    print("Depth   : {:10.4f} km  ".format(depth))
+    print("Density : {:10.4f} t/m3".format(result['density']))
+    print("Vp      : {:10.4f} km/s".format(result['vp']))
+    print("Vs      : {:10.4f} km/s".format(result['vs']))
+    print("Qkappa  : {:10.4f}     ".format(result['qkappa']))
+    print("Qmu     : {:10.4f}     ".format(result['qmu']))
+    print("Pressure: {:10.4f} GPa ".format(result['pressure']))
+    print()
+
+
+def main(argv=None):
+    args = read_args(argv)
+    spherical = False if args.constant_g else None
+    try:
+        if args.model.lower() not in MODELS and os.path.isfile(args.model):
+            model = ReferenceModel(args.model, spherical is None)
+        else:
+            model = get_model(args.model, spherical)
+    except ValueError as err:
+        sys.exit('Error: ' + ' '.join(str(a) for a in err.args))
+    if args.file is None:
+        compute(args.depth, model)
+        return
+    properties = [p.strip() for p in args.properties.split(',')]
+    fin = sys.stdin if args.file == '-' else open(args.file)
+    fout = sys.stdout if args.output is None else open(args.output, 'w')
+    try:
+        stream(fin, fout, model, args.column, properties, args.chunksize)
+    finally:
+        if fin is not sys.stdin:
+            fin.close()
+        if fout is not sys.stdout:
+            fout.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Reader for GMS scattered data files of regular grids, e.g. the thickness
+maps t_<layer>.dat, the surface and DensityMantle.dat.
+
+Parsed grids are cached as .npy files in a .gmscache directory next to the
+source file. The cache is keyed by the size and modification time of the
+source, so later reads load the grid in milliseconds and can memory map it:
+
+    x, y, grd = read_gms_grid('t_Crust.dat')
+
+@author: chmee
+"""
+
+import numpy as np
+import json
+import os
+import itertools
+
+CACHE_DIR = '.gmscache'
+
+
+def read_header(fname):
+    """
+    Read the header of a GMS scattered data file.
+
+    Parameters:
+
+    * fname : str
+        File name
+
+    Returns:
+
+    * header : dict
+        Keys and values of the header lines. Fields are collected in the
+        list 'fields' of [column, name, unit]. 'nlines' is the number of
+        header lines.
+    """
+    header = dict(fields=[])
+    nlines = 0
+    with open(fname) as f:
+        for line in f:
+            if not line.startswith('#'):
+                break
+            nlines += 1
+            key, _, value = line[1:].partition(':')
+            key = key.strip().lower()
+            value = value.strip()
+            if key == 'field':
+                field = value.split()
+                header['fields'].append([int(field[0]), field[1],
+                                         ' '.join(field[2:])])
+            elif key == 'end':
+                break
+            elif key:
+                header[key] = value
+    header['nlines'] = nlines
+    return header
+
+
+def _read_chunks(fname, chunksize):
+    """
+    Generator over the x, y and z columns of a GMS file in chunks of rows.
+    """
+    with open(fname) as f:
+        while True:
+            lines = list(itertools.islice(f, chunksize))
+            if not lines:
+                break
+            lines = [l for l in lines if l.strip() and not l.startswith('#')]
+            if lines:
+                yield np.loadtxt(lines, usecols=(0, 1, 2), ndmin=2)
+
+
+def parse_gms_grid(fname, out=None, chunksize=1000000):
+    """
+    Parse a GMS scattered data file into a 2D grid. The file is read in
+    chunks, so memory use is bounded by the chunk size and the grid.
+
+    Parameters:
+
+    * fname : str
+        File name
+    * out : str
+        If given, the grid is written to this .npy file and returned
+        memory mapped
+    * chunksize : int
+        Number of lines read at a time
+
+    Returns:
+
+    * x, y : numpy array
+        1D arrays with the coordinates of the grid
+    * grd : numpy array
+        2D array of structure [x, y]. Grid points that are missing in the
+        file are nan.
+    * header : dict
+        Header as returned by read_header(). 'regular' is True if the
+        coordinates are equally spaced, 'dx' and 'dy' are the spacing.
+    """
+    header = read_header(fname)
+    # First pass for the coordinates, second pass for the values
+    x = y = np.empty(0)
+    for data in _read_chunks(fname, chunksize):
+        x = np.union1d(x, data[:, 0])
+        y = np.union1d(y, data[:, 1])
+    if out is None:
+        grd = np.full([len(x), len(y)], np.nan)
+    else:
+        grd = np.lib.format.open_memmap(out, mode='w+', dtype=float,
+                                        shape=(len(x), len(y)))
+        grd[:] = np.nan
+    for data in _read_chunks(fname, chunksize):
+        grd[np.searchsorted(x, data[:, 0]),
+            np.searchsorted(y, data[:, 1])] = data[:, 2]
+    regular = True
+    for key, vals in [('dx', x), ('dy', y)]:
+        step = np.diff(vals)
+        header[key] = float(step[0]) if len(step) else 0.0
+        if len(step) and not np.allclose(step, step[0]):
+            regular = False
+    header['regular'] = regular
+    return x, y, grd, header
+
+
+def _cache_names(fname):
+    st = os.stat(fname)
+    folder, name = os.path.split(os.path.abspath(fname))
+    base = os.path.join(folder, CACHE_DIR, name)
+    key = '{}.{:d}.{:d}'.format(base, st.st_size, st.st_mtime_ns)
+    return base, key + '.npy', key + '.json'
+
+
+def _tmp_name(fname):
+    # Results are written to a temporary file first and renamed, so that
+    # concurrent readers never see a partial file
+    return '{}.{}.tmp'.format(fname, os.getpid())
+
+
+def _read_cached(fname, mmap_mode):
+    """
+    Load a grid from the cache, or parse it into the cache if the cache is
+    missing or outdated.
+    """
+    base, fgrd, fmeta = _cache_names(fname)
+    try:
+        with open(fmeta) as f:
+            meta = json.load(f)
+        grd = np.load(fgrd, mmap_mode=mmap_mode)
+        return np.array(meta['x']), np.array(meta['y']), grd, meta['header']
+    except (OSError, ValueError):
+        pass
+    folder = os.path.dirname(base)
+    try:
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        # Remove outdated versions of this file, but not the current one,
+        # which another process may have written in the meantime
+        prefix = os.path.basename(base) + '.'
+        current = [os.path.basename(fgrd), os.path.basename(fmeta)]
+        for old in os.listdir(folder):
+            if old.startswith(prefix) and old not in current and \
+                    old.count('.') == prefix.count('.') + 2:
+                try:
+                    os.remove(os.path.join(folder, old))
+                except FileNotFoundError:
+                    pass
+        x, y, grd, head = parse_gms_grid(fname, _tmp_name(fgrd))
+        grd.flush()
+        del grd
+        os.replace(_tmp_name(fgrd), fgrd)
+        with open(_tmp_name(fmeta), 'w') as f:
+            json.dump(dict(x=x.tolist(), y=y.tolist(), header=head), f)
+        os.replace(_tmp_name(fmeta), fmeta)
+        return x, y, np.load(fgrd, mmap_mode=mmap_mode), head
+    except OSError:
+        # No cache if the directory is not writable or the cache was
+        # removed by another process
+        return parse_gms_grid(fname)
+
+
+def read_gms_grid(fname, cache=True, mmap_mode='r', header=False):
+    """
+    Read a GMS scattered data file into a 2D grid, using the binary cache if
+    it is up to date.
+
+    Parameters:
+
+    * fname : str
+        File name
+    * cache : bool
+        Use and update the cache
+    * mmap_mode : str
+        Memory map mode for cached grids as for numpy.load, None reads
+        the grid into memory
+    * header : bool
+        Also return the header
+
+    Returns:
+
+    * x, y : numpy array
+        1D arrays with the coordinates of the grid
+    * grd : numpy array
+        2D array of structure [x, y], missing grid points are nan
+    * header : dict
+        Only if header is True, see parse_gms_grid()
+    """
+    if cache:
+        result = _read_cached(fname, mmap_mode)
+    else:
+        result = parse_gms_grid(fname)
+    if header:
+        return result
+    return result[:3]
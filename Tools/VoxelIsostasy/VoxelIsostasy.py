@@ -6,32 +6,48 @@ Calculate the isostatic density distribution of a layer assuming a density
 distribution in the mantle. The calculation utilises thickness maps and
 configuration files from GMS models.
 
-Parameters:
+The calculation is done by the Isostasy class, which can be used from other
+scripts:
 
-    * flay : str
-        File name for *_lay.dat
+    model = Isostasy.from_project('CPB2', fdensmantle='DensityMantle.dat')
+    rhocrust = model.density(6.62e9)
 
-    * fdensmantle : str
-        File name for mantle density distribution
-
-    * mantle : str
-        Layer name for mantle
-
-    * crust : str
-        The layer name in the model that will be isostatically adjusted
-
-    * targetload : float
-        Target load at the bottom of the model in Pa
-
-    * fout : str
-        Output file name for layer density
+Command line usage: VoxelIsostasy GMSName Load [Load ...]
+                        [-vox|-lm|-lc|-out|-cube|-tile|-float32|-h]
 
 @author: chmee
 """
 
 import numpy as np
+import argparse
+import os
 import sys
 import time
+import zipfile
+from GMSGrid import read_gms_grid
+
+HELP = """
+Calculates the isostatic density distribution of a layer assuming a
+density distribution in the mantle. The calculation utilises
+thickness maps and configuration files from GMS models. For
+required files see section below. The mantle density distribution
+must be a 2D grid file, not a voxel! Use the script VoxelAverage to
+calculate 2D average grids from 3D voxels.
+
+Required input files:
+   - lay.dat
+   - strat.dat
+   - surface (same name as in strat.dat)
+   - thickness maps (name: t_layer.dat)
+
+Several loads or ranges of loads can be given, e.g. 6.5:6.7:0.01 for all
+loads from 6.5 to 6.7 GPa in steps of 0.01 GPa. The model is read once for
+all of them.
+
+Large models can be processed out-of-core with -tile, which reads the
+thickness maps and writes the densities one tile of x-rows at a time.
+"""
+
 
 def grd2tab(grd, xmin, xmax, ymin, ymax):
     """
@@ -51,193 +67,289 @@ def grd2tab(grd, xmin, xmax, ymin, ymax):
         Array in table-style of structure [rows, 3].
     """
     nx, ny = grd.shape
-    dx = (xmax - xmin)/(nx - 1)
-    dy = (ymax - ymin)/(ny - 1)
-    arr = np.empty([nx*ny, 3])
-    row = 0
-    for x in range(nx):
-        for y in range(ny):
-            arr[row, 0] = xmin + x*dx
-            arr[row, 1] = ymin + y*dy
-            arr[row, 2] = grd[x, y]
-            row += 1
-    return arr
-
-def ShowHelp():
-    print
-    print "Calculates the isostatic density distribution of a layer assuming a"
-    print "density distribution in the mantle. The calculation utilises"
-    print "thickness maps and configuration files from GMS models. For"
-    print "required files see section below. The mantle density distribution"
-    print "must be a 2D grid file, not a voxel! Use the script VoxelAverage to"
-    print "calculate 2D average grids from 3D voxels."
-    print
-    print "Usage: VoxelIsostasy GMSName Load [optional parameters]"
-    print
-    print "   GMSName  GMS Project name"
-    print "   Load     Load at model base in GPa"
-    print
-    print "Optional parameters:"
-    print "   -vox     Filename of input density distribution. Default file"
-    print "            name: DensityMantle.dat. The input file must be a "
-    print "            X Y Z file."
-    print "   -lm      Mantle layer name. Default: LithMantle"
-    print "   -lc      Crustal layer name. Default: Crust"
-    print "   -out     Output file name."
-    print
-    print "Required input files:"
-    print "   - lay.dat"
-    print "   - strat.dat"
-    print "   - surface (same name as in strat.dat)"
-    print "   - thickness maps (name: t_layer.dat)"
-    print
-    sys.exit()
+    x, y = np.meshgrid(np.linspace(xmin, xmax, nx),
+                       np.linspace(ymin, ymax, ny), indexing='ij')
+    return np.column_stack([x.ravel(), y.ravel(), grd.ravel()])
 
-if __name__ == "__main__":
-    # Default values
-    fdensmantle = 'DensityMantle.dat'
-    crust = 'Crust'
-    mantle = 'LithMantle'
-    usevox = False
-    fout = None
-    tstart = time.ctime()
 
-    # Read command line arguments
-    n_args = len(sys.argv)
-    if n_args > 1 and sys.argv[1] == "-h":
-        ShowHelp()
-    if n_args < 3:
-        print
-        print "Error: not enough arguments!"
-        # print "Usage: VoxelIsostasy PROJECT LOAD [-vox|-lm|-lc|-out|-h]"
-        ShowHelp()
-        sys.exit()
-    project = sys.argv[1]
-    targetloadGPa = float(sys.argv[2])
-    targetload = targetloadGPa*1E9
-    i = 3
-    while i < n_args:
-        if sys.argv[i] == '-vox':
-            fdensmantle = sys.argv[i + 1]
-            usevox = True
-            i+=1
-        elif sys.argv[i] == '-lc':
-            crust = sys.argv[i + 1]
-            i+=1
-        elif sys.argv[i] == '-lm':
-            mantle = sys.argv[i + 1]
-            i+=1
-        elif sys.argv[i] == '-out':
-            fout = sys.argv[i + 1]
-            i+=1
-        i += 1
-
-    if fout is None:
-        fout = project + '_RhoCrust_' + str(targetloadGPa) + 'GPa.dat'
-
-    fstrat = project + '_strat.dat'
-    flay = project + '_lay.dat'
-    strat = np.genfromtxt(fstrat, dtype=None, comments='/', usecols=(2))
-    fsurf = strat[-1]
-    crustidx = None
-
-    g = 9.81
-
-    print 'Importing data'
-    surface = np.loadtxt(fsurf, usecols=(0, 1, 2))
-    if usevox:
-        densmantle = np.loadtxt(fdensmantle, usecols=(0, 1, 2))
-        print 'Testing data integrity'
-        if surface.shape == densmantle.shape:
-            print '> Number of points ok'
-        else:
-            print
-            print "ERROR: Mismatch in points between GMS model and mantle density"
-            print "Surface shape       :", surface.shape
-            print "Mantle density shape:", densmantle.shape
-            print
-            sys.exit()
-        if np.equal(surface[:, 0], densmantle[:, 0]).all():
-            print '> X-coords ok'
-        else:
-            print
-            print "ERROR: X-coords of GMS model and mantle density are unequal"
-            print
-            sys.exit()
-        if np.equal(surface[:, 1], densmantle[:, 1]).all():
-            print '> Y-coords ok'
-        else:
-            print
-            print "ERROR: Y-coords of GMS Model and mantle density are unequal"
-            print
-            sys.exit()
-
-    print 'Loading', flay
-    laydat = np.genfromtxt(flay, dtype=None)
-    layers=[]       # Array containing layer names
-    densities=[]    # Contains densities for each layer
-    thickness=[]    # Contains thickness information
-    i = 0
-    for elem in laydat:
-        print '> Processing', elem[0]
-        layers.append(elem[0])
-        densities.append(elem[1])
-        fthick = "t_" + elem[0] + ".dat"
-        thickness.append(np.loadtxt(fthick, usecols=(0, 1, 2)))
-        if elem[0] == crust:
-            crustidx = i
-        i+=1
-
-    if crustidx is None:
-        print 'Error: layer', crust, 'not found in ', flay
-        sys.exit()
-
-    print 'Transferring data tables to arrays'
-    xmin, ymin, tmp = surface.min(0)
-    xmax, ymax, tmp= surface.max(0)
-    xvals = np.unique(surface[:, 0])
-    yvals = np.unique(surface[:, 1])
-    dx = xvals[1] - xvals[0]
-    dy = yvals[1] - yvals[0]
-    nx = len(xvals)
-    ny = len(yvals)
-    nlay = len(layers)
-    # 4th dimension in model array contains thickness [0] and density [1] at
-    # each point
-    model = np.empty([nx, ny, nlay, 2])
-    for i in range(nlay):
-        # Go through each coordinate and assign thickness and density
-        print '> Processing layer: ' + layers[i]
-        row = 0
-        for point in thickness[i]:
-            xarr = int((point[0] - xmin)/dx)
-            yarr = int((point[1] - ymin)/dy)
-            # Assign thickness
-            model[xarr, yarr, i, 0] = point[2]
-            if layers[i] != mantle:
-                # Assign layer density
-                model[xarr, yarr, i, 1] = densities[i]
-            else:
-                # Assign mantle density
-                if usevox:
-                    model[xarr, yarr, i, 1] = densmantle[row, 2]
-                else:
-                    model[xarr, yarr, i, 1] = densities[i]
-            row += 1
-
-    print 'Calculating load at bottom'
-    model[:, :, crustidx, 1] = 0
-    load = np.zeros([nx, ny])
-    for i in range(nlay):
-        load += model[:, :, i, 1]*g*model[:, :, i, 0]
-
-    print 'Calculating density distribution for', crust
-    rhocrust = np.zeros([nx, ny])
-    rhocrust = -1*(load - targetload)/g/model[:, :, crustidx, 0]
-    rhomin = int(np.round(np.min(rhocrust), 0))
-    rhomax = int(np.round(np.max(rhocrust), 0))
-    print "> Density range:", rhomin, '-', rhomax
+def read_layers(project, path='.'):
+    """
+    Read layer names, densities and the surface file name of a GMS project.
+
+    Parameters:
+
+    * project : str
+        GMS project name, *_lay.dat and *_strat.dat are read
+    * path : str
+        Directory of the project files
+
+    Returns:
+
+    * layers : list of str
+        Layer names from top to bottom
+    * densities : list of float
+        Matrix density of each layer in kg/m3
+    * fsurf : str
+        File name of the surface
+    """
+    fstrat = os.path.join(path, project + '_strat.dat')
+    flay = os.path.join(path, project + '_lay.dat')
+    strat = np.genfromtxt(fstrat, dtype=str, comments='/', usecols=(2))
+    laydat = np.genfromtxt(flay, dtype=None, encoding='utf-8',
+                           usecols=(0, 1))
+    layers = [str(elem[0]) for elem in laydat]
+    densities = [float(elem[1]) for elem in laydat]
+    return layers, densities, os.path.join(path, str(strat[-1]))
+
+
+def read_project(project, path='.', fdensmantle=None, mantle='LithMantle'):
+    """
+    Read the layers and grids of a GMS project. Grids are memory mapped
+    from the cache of GMSGrid, so only the parts that are used are read.
+    Grids with missing points raise a ValueError.
+
+    Parameters:
+
+    * project : str
+        GMS project name
+    * path : str
+        Directory of the project files
+    * fdensmantle : str
+        GMS file with the density distribution of the mantle layer on the
+        points of the surface. If None, the density of *_lay.dat is used.
+    * mantle : str
+        Mantle layer name
+
+    Returns:
+
+    * layers : list of str
+        Layer names from top to bottom
+    * densities : list
+        Density of each layer in kg/m3, float or 2D array of structure [x, y]
+    * thickness : list of numpy array
+        Thickness of each layer in m as 2D array of structure [x, y]
+    * x, y : numpy array
+        1D arrays with the coordinates of the grid
+    """
+    layers, densities, fsurf = read_layers(project, path)
+    x, y, surface = read_gms_grid(fsurf)
+
+    def read_grid(fname):
+        gx, gy, grd = read_gms_grid(fname)
+        if not (np.array_equal(gx, x) and np.array_equal(gy, y)):
+            raise ValueError('Coordinates differ from the surface', fname)
+        if np.isnan(grd).any():
+            raise ValueError('Grid points are missing in', fname)
+        return grd
+
+    if fdensmantle is not None:
+        if mantle not in layers:
+            raise ValueError('Layer not found', mantle)
+        densities[layers.index(mantle)] = read_grid(fdensmantle)
+    thickness = [read_grid(os.path.join(path, 't_' + layer + '.dat'))
+                 for layer in layers]
+    return layers, densities, thickness, x, y
+
+
+class Isostasy:
+    """
+    Isostatic density of one layer of a layered model.
+
+    The load at the base of the model is the sum of density times g times
+    thickness of all layers. The density of the adjusted layer is chosen so
+    that this load equals a target load everywhere.
+
+    Parameters:
+
+    * layers : list of str
+        Layer names from top to bottom
+    * densities : list
+        Density of each layer in kg/m3, either a float or a 2D array of
+        structure [x, y]
+    * thickness : numpy array
+        Layer thickness in m of structure [layer, x, y]
+    * crust : str
+        The layer that is isostatically adjusted
+    * extent : list of float
+        [xmin, xmax, ymin, ymax] of the grid
+    * g : float
+        Gravitational acceleration in m/s2
+    """
+
+    def __init__(self, layers, densities, thickness, crust='Crust',
+                 extent=(0., 1., 0., 1.), g=9.81):
+        if crust not in layers:
+            raise ValueError('Layer not found', crust)
+        thickness = np.asarray(thickness, dtype=float)
+        if thickness.shape[0] != len(layers) or \
+                len(densities) != len(layers):
+            raise ValueError('Number of layers, densities and thickness maps '
+                             'differ', len(layers))
+        self.layers = list(layers)
+        self.crust = crust
+        self.crustidx = self.layers.index(crust)
+        self.extent = list(extent)
+        self.g = g
+        self.thickness_crust = thickness[self.crustidx]
+        # Load of all layers but the adjusted one, which is the only part
+        # that does not depend on the target load
+        self.load = np.zeros(thickness.shape[1:])
+        for i in range(len(self.layers)):
+            if i != self.crustidx:
+                self.load += np.asarray(densities[i])*g*thickness[i]
+
+    @classmethod
+    def from_project(cls, project, path='.', fdensmantle=None,
+                     mantle='LithMantle', crust='Crust', g=9.81):
+        """
+        Set up the model from the files of a GMS project.
+
+        Parameters:
+
+        * project : str
+            GMS project name
+        * path : str
+            Directory of the project files
+        * fdensmantle : str
+            GMS file with the density distribution of the mantle layer on
+            the points of the surface. If None, the density of *_lay.dat is
+            used.
+        * mantle : str
+            Mantle layer name
+        * crust : str
+            The layer that is isostatically adjusted
+        * g : float
+            Gravitational acceleration in m/s2
+
+        Returns:
+
+        * model : Isostasy
+        """
+        layers, densities, thickness, x, y = read_project(
+            project, path, fdensmantle, mantle)
+        extent = [x[0], x[-1], y[0], y[-1]]
+        return cls(layers, densities, thickness, crust, extent, g)
+
+    def density(self, targetload):
+        """
+        Compute the density of the adjusted layer. Several target loads are
+        computed in one pass, which is cheap as the density is affine in the
+        load.
 
+        Parameters:
+
+        * targetload : float or 1D numpy array
+            Target load(s) at the bottom of the model in Pa
+
+        Returns:
+
+        * rhocrust : numpy array
+            Array of structure [x, y], or [load, x, y] for several loads,
+            with the density in kg/m3
+        """
+        targetload = np.asarray(targetload, dtype=float)[..., None, None]
+        return -(self.load - targetload)/self.g/self.thickness_crust
+
+    def table(self, rhocrust):
+        """
+        Convert a density grid to a table of x, y and density.
+        """
+        return grd2tab(rhocrust, *self.extent)
+
+
+def density_tiles(layers, densities, thickness, targetload, fout,
+                  crust='Crust', g=9.81, rows=256, dtype=np.float64):
+    """
+    Out-of-core version of Isostasy.density(). The grids are processed in
+    tiles of x-rows and the density is written to a .npy file tile by tile,
+    so memory use is bounded by the tile size. Memory mapped grids, e.g.
+    those of read_project(), are only read one tile at a time.
+
+    Parameters:
+
+    * layers : list of str
+        Layer names from top to bottom
+    * densities : list
+        Density of each layer in kg/m3, either a float or a 2D array of
+        structure [x, y]
+    * thickness : list of numpy array
+        Thickness of each layer in m as 2D array of structure [x, y]
+    * targetload : float or 1D numpy array
+        Target load(s) at the bottom of the model in Pa
+    * fout : str
+        Output .npy file
+    * crust : str
+        The layer that is isostatically adjusted
+    * g : float
+        Gravitational acceleration in m/s2
+    * rows : int
+        Number of x-rows per tile
+    * dtype : numpy dtype
+        Data type of the load accumulator and the output, np.float32 halves
+        memory and disk use
+
+    Returns:
+
+    * rhocrust : numpy memmap
+        Array of structure [x, y], or [load, x, y] for several loads, with
+        the density in kg/m3
+    """
+    if crust not in layers:
+        raise ValueError('Layer not found', crust)
+    crustidx = list(layers).index(crust)
+    nx, ny = thickness[0].shape
+    targetload = np.asarray(targetload, dtype=float)
+    out = np.lib.format.open_memmap(fout, mode='w+', dtype=dtype,
+                                    shape=targetload.shape + (nx, ny))
+    for start in range(0, nx, rows):
+        stop = min(start + rows, nx)
+        load = np.zeros((stop - start, ny), dtype=dtype)
+        for i in range(len(layers)):
+            if i == crustidx:
+                continue
+            rho = densities[i]
+            if np.ndim(rho):
+                rho = rho[start:stop]
+            load += rho*g*thickness[i][start:stop]
+        out[..., start:stop, :] = -(load - targetload[..., None, None]) \
+            /g/thickness[crustidx][start:stop]
+    out.flush()
+    return out
+
+
+def save_density(fout, extent, rhocrust, project, fdensmantle, targetloadGPa,
+                 tstart=None, rows=256):
+    """
+    Save the density of the adjusted layer as an X Y Z table. The grid is
+    written in tiles of x-rows, so it can be a memory mapped array that does
+    not fit into memory.
+
+    Parameters:
+
+    * fout : str
+        Output file name
+    * extent : list
+        [xmin, xmax, ymin, ymax] of the grid points, e.g. Isostasy.extent
+    * rhocrust : numpy array
+        2D array of structure [x, y] with the density in kg/m3
+    * project, fdensmantle, targetloadGPa : str or float
+        Input description for the header
+    * tstart : str
+        Creation time for the header, default: now
+    * rows : int
+        Number of x-rows per tile
+
+    Returns:
+
+    * rhomin, rhomax : int
+        Rounded range of the density
+    """
+    if tstart is None:
+        tstart = time.ctime()
+    nx, ny = rhocrust.shape
+    starts = range(0, nx, rows)
+    rhomin = int(np.round(min(np.min(rhocrust[i:i + rows]) for i in starts)))
+    rhomax = int(np.round(max(np.max(rhocrust[i:i + rows]) for i in starts)))
     h = "Crustal isostatic density\n"
     h += "Created: " + str(tstart) + "\n"
     h += "Input GMS project: " + str(project) + "\n"
@@ -249,7 +361,177 @@ if __name__ == "__main__":
     h += "0 - X\n"
     h += "1 - Y\n"
     h += "2 - Density / kg/m3"
+    xmin, xmax, ymin, ymax = extent
+    x = np.linspace(xmin, xmax, nx)
+    with open(fout, 'w') as f:
+        for start in starts:
+            stop = min(start + rows, nx)
+            np.savetxt(f, grd2tab(rhocrust[start:stop], x[start], x[stop - 1],
+                                  ymin, ymax),
+                       fmt='%f', header=h if start == 0 else '')
+    return rhomin, rhomax
+
 
-    print 'Save result to', fout
-    np.savetxt(fout, grd2tab(rhocrust, xmin, xmax, ymin, ymax), fmt='%f',
-               header=h)
\ No newline at end of file
+def save_cube(fcube, rhocrust, loads, extent, rows=256):
+    """
+    Save the densities for several loads as .npz file with the arrays
+    rho [load, x, y], load, x and y. rho is copied in tiles of x-rows, so it
+    can be a memory mapped array that does not fit into memory.
+
+    Parameters:
+
+    * fcube : str
+        Output .npz file
+    * rhocrust : numpy array
+        3D array of structure [load, x, y] with the density in kg/m3
+    * loads : numpy array
+        1D array of the loads in GPa
+    * extent : list
+        [xmin, xmax, ymin, ymax] of the grid points
+    * rows : int
+        Number of x-rows per tile
+    """
+    nload, nx, ny = rhocrust.shape
+    xmin, xmax, ymin, ymax = extent
+    arrays = [('load', np.asarray(loads)), ('x', np.linspace(xmin, xmax, nx)),
+              ('y', np.linspace(ymin, ymax, ny))]
+    with zipfile.ZipFile(fcube, 'w', allowZip64=True) as zf:
+        for name, arr in arrays:
+            with zf.open(name + '.npy', 'w') as f:
+                np.lib.format.write_array(f, arr)
+        # Stream the header and the data of rho like numpy.lib.format does
+        with zf.open('rho.npy', 'w', force_zip64=True) as f:
+            np.lib.format.write_array_header_2_0(f, dict(
+                descr=np.lib.format.dtype_to_descr(rhocrust.dtype),
+                fortran_order=False, shape=rhocrust.shape))
+            for rho in rhocrust:
+                for start in range(0, nx, rows):
+                    f.write(np.ascontiguousarray(rho[start:start + rows])
+                            .tobytes())
+
+
+def parse_loads(values):
+    """
+    Convert a list of loads and ranges to an array of loads.
+
+    Parameters:
+
+    * values : list of str
+        Loads as float, or ranges as start:stop:step with stop included
+
+    Returns:
+
+    * loads : numpy array
+        1D array of loads
+    """
+    loads = []
+    for value in values:
+        if ':' in value:
+            start, stop, step = [float(v) for v in value.split(':')]
+            if step <= 0:
+                raise ValueError('Step must be positive', value)
+            loads.extend(np.arange(start, stop + 0.5*step, step))
+        else:
+            loads.append(float(value))
+    # Remove round off from the ranges, which would show in file names
+    return np.round(np.array(loads), 10)
+
+
+def main(argv=None):
+    """
+    Command line interface, see HELP.
+    """
+    parser = argparse.ArgumentParser(
+        prog='VoxelIsostasy', description=HELP,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('project', metavar='GMSName',
+                        help='GMS Project name')
+    parser.add_argument('load', metavar='Load', nargs='+',
+                        help='Load(s) at model base in GPa, or ranges of '
+                        'loads as start:stop:step')
+    parser.add_argument('-vox', dest='fdensmantle',
+                        help='Filename of input density distribution. The '
+                        'input file must be a X Y Z file. Default: density '
+                        'of the mantle layer in lay.dat')
+    parser.add_argument('-lm', dest='mantle', default='LithMantle',
+                        help='Mantle layer name. Default: LithMantle')
+    parser.add_argument('-lc', dest='crust', default='Crust',
+                        help='Crustal layer name. Default: Crust')
+    parser.add_argument('-out', dest='fout',
+                        help='Output file name. For several loads it must '
+                        'contain {} which is replaced by the load.')
+    parser.add_argument('-cube', dest='fcube',
+                        help='Save the densities for all loads as one .npz '
+                        'file with the arrays rho [load, x, y], load, x and '
+                        'y. No text files are written unless -out is given.')
+    parser.add_argument('-tile', dest='rows', type=int,
+                        help='Process the model in tiles of this many x-rows '
+                        'for models that do not fit into memory. The '
+                        'densities are kept in a temporary .npy file while '
+                        'the output files are written.')
+    parser.add_argument('-float32', dest='dtype', action='store_const',
+                        const=np.float32, default=np.float64,
+                        help='Use single precision in tiled mode')
+    args = parser.parse_args(argv)
+    tstart = time.ctime()
+    try:
+        loads = parse_loads(args.load)
+    except ValueError as err:
+        parser.error('Invalid load: ' + str(err.args[-1]))
+
+    fout = args.fout
+    if fout is None and args.fcube is None:
+        fout = args.project + '_RhoCrust_{}GPa.dat'
+    if fout is not None and len(loads) > 1 and '{}' not in fout:
+        parser.error('-out must contain {} for several loads')
+
+    print('Importing data')
+    ftmp = None
+    try:
+        if args.rows is None:
+            model = Isostasy.from_project(args.project,
+                                          fdensmantle=args.fdensmantle,
+                                          mantle=args.mantle,
+                                          crust=args.crust)
+            extent = model.extent
+            print('Calculating density distribution for', args.crust)
+            rhocrust = model.density(loads*1E9)
+        else:
+            layers, densities, thickness, x, y = read_project(
+                args.project, fdensmantle=args.fdensmantle,
+                mantle=args.mantle)
+            extent = [x[0], x[-1], y[0], y[-1]]
+            print('Calculating density distribution for', args.crust)
+            ftmp = '{}_RhoCrust.{}.tmp.npy'.format(args.project, os.getpid())
+            rhocrust = density_tiles(layers, densities, thickness,
+                                     loads*1E9, ftmp, args.crust,
+                                     rows=args.rows, dtype=args.dtype)
+    except ValueError as err:
+        print()
+        print('ERROR:', *err.args)
+        print()
+        if ftmp is not None and os.path.exists(ftmp):
+            os.remove(ftmp)
+        sys.exit(1)
+
+    rows = args.rows or 256
+    try:
+        if args.fcube is not None:
+            print('Save result to', args.fcube)
+            save_cube(args.fcube, rhocrust, loads, extent, rows)
+        if fout is not None:
+            for load, rho in zip(loads, rhocrust):
+                fname = fout.format(load)
+                print('Save result to', fname)
+                rhomin, rhomax = save_density(fname, extent, rho,
+                                              args.project, args.fdensmantle,
+                                              load, tstart, rows)
+                print("> Density range:", rhomin, '-', rhomax)
+    finally:
+        if ftmp is not None:
+            del rhocrust
+            os.remove(ftmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+################################################################################
+#                     Copyright (C) 2019 by Christian Meessen                  #
+#                                                                              #
+#                         This file is part of Scripts                         #
+#                                                                              #
+#        Scripts is free software: you can redistribute it and/or modify       #
+#     it under the terms of the GNU General Public License as published by     #
+#           the Free Software Foundation version 3 of the License.             #
+#                                                                              #
+#      GMTScripts is distributed in the hope that it will be useful, but       #
+#          WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU       #
+#                   General Public License for more details.                   #
+#                                                                              #
+#      You should have received a copy of the GNU General Public License       #
+#       along with Scripts. If not, see <http://www.gnu.org/licenses/>.        #
+################################################################################
+"""
+Benchmarks of the numerical kernels in this repository.
+
+Times the rheology kernels for increasing numbers of depth samples and
+materials, the AK135 lookups and VoxelIsostasy. The results are written as
+JSON and can be compared against a baseline file, in which case the script
+exits with status 1 if a case got slower than the allowed threshold or
+failed although it ran in the baseline.
+
+Usage: python benchmark.py [-o results.json] [--baseline FILE]
+                           [--threshold 1.25] [--quick]
+"""
+import os
+import sys
+import json
+import time
+import timeit
+import platform
+import argparse
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ['RheologyExplorer',
+               os.path.join('Tools', 'AK135'),
+               os.path.join('Tools', 'VoxelIsostasy')]:
+    sys.path.insert(0, os.path.join(ROOT, folder))
+
+
+def geotherm(n):
+    """Depth (m) and temperature (K) profile with n samples."""
+    z = np.linspace(0, 100e3, n)
+    return z, 283.0 + 0.012*z
+
+
+def library(nmat):
+    """Material table with nmat entries, repeating the built-in ones."""
+    import rheology_explorer as rx
+    mats = rx.materials()
+    return mats[np.arange(nmat) % len(mats)]
+
+
+def case_sigma_d(n):
+    import rheology_explorer as rx
+    mat = rx.materials()[0]
+    z, T = geotherm(n)
+    return lambda: rx.sigma_d(mat, z, T, 1e-15, mode='compression')
+
+
+def case_compute_dsigma(n):
+    import rheology_explorer as rx
+    mat = rx.materials()[0]
+    z, T = geotherm(n)
+    return lambda: rx.compute_dsigma(mat, z, T, 1e-15)
+
+
+def case_compute_dsigma_batch(n, nmat):
+    import rheology_explorer as rx
+    columns = rx.material_arrays(library(nmat))
+    z, T = geotherm(n)
+    return lambda: rx.compute_dsigma_batch(columns, z, T, 1e-15)
+
+
+def case_ak135_load():
+    import AK135
+    return lambda: AK135.AK135()
+
+
+def case_ak135_scalar(n):
+    import AK135
+    model = AK135.AK135()
+    z = np.linspace(0, 6000, n)
+    return lambda: [model(zi) for zi in z]
+
+
+def case_ak135_array(n):
+    import AK135
+    model = AK135.AK135()
+    z = np.linspace(0, 6000, n)
+    return lambda: model(z)
+
+
+def case_grd2tab(n):
+    import VoxelIsostasy
+    grd = np.random.default_rng(0).random([n, n])
+    return lambda: VoxelIsostasy.grd2tab(grd, 0.0, 1.0, 0.0, 1.0)
+
+
+def case_isostasy(n, nlay=10):
+    import VoxelIsostasy
+    rng = np.random.default_rng(0)
+    layers = ['L{:d}'.format(i) for i in range(nlay)]
+    densities = list(2000.0 + 100.0*np.arange(nlay))
+    thickness = 1000.0 + 1000.0*rng.random([nlay, n, n])
+
+    def run():
+        model = VoxelIsostasy.Isostasy(layers, densities, thickness, 'L5')
+        return model.density(6.62e9)
+    return run
+
+
+def cases(quick=False, max_points=1e7):
+    """
+    List of benchmark cases (name, parameters, number of evaluated points,
+    factory). The factory returns the function to time.
+    """
+    depths = [10**3, 10**4, 10**5] if quick else \
+        [10**3, 10**4, 10**5, 10**6, 10**7]
+    nmats = [1, 10, 100] if quick else [1, 10, 100, 500]
+    out = []
+    for n in depths:
+        out.append(('sigma_d', dict(depths=n), n,
+                    lambda n=n: case_sigma_d(n)))
+        out.append(('compute_dsigma', dict(depths=n), 2*n,
+                    lambda n=n: case_compute_dsigma(n)))
+    for nmat in nmats:
+        for n in depths:
+            if nmat*n > max_points:
+                continue
+            out.append(('compute_dsigma_batch',
+                        dict(depths=n, materials=nmat), 2*n*nmat,
+                        lambda n=n, nmat=nmat:
+                        case_compute_dsigma_batch(n, nmat)))
+    out.append(('ak135_load', dict(), 1, case_ak135_load))
+    out.append(('ak135_scalar', dict(depths=1000), 1000,
+                lambda: case_ak135_scalar(1000)))
+    for n in depths[:4]:
+        out.append(('ak135_array', dict(depths=n), n,
+                    lambda n=n: case_ak135_array(n)))
+    for n in [100, 1000]:
+        out.append(('voxelisostasy_grd2tab', dict(nx=n, ny=n), n*n,
+                    lambda n=n: case_grd2tab(n)))
+        out.append(('voxelisostasy_density', dict(nx=n, ny=n, layers=10),
+                    n*n*10, lambda n=n: case_isostasy(n)))
+    return out
+
+
+def run(case, repeat):
+    """
+    Time a case and return its result record. The best time per call of
+    repeat runs is reported. Cases that cannot run record the error instead.
+    """
+    name, params, npoints, factory = case
+    record = dict(name=name, params=params, points=npoints)
+    try:
+        timer = timeit.Timer(factory())
+        # Fast cases are looped until a run takes at least 0.2 s
+        number = timer.autorange()[0]
+        seconds = min(timer.repeat(repeat, number))/number
+    except Exception as err:
+        record['error'] = '{}: {}'.format(type(err).__name__, err)
+        return record
+    record['seconds'] = seconds
+    record['points_per_second'] = npoints/seconds
+    return record
+
+
+def key(record):
+    return record['name'] + json.dumps(record['params'], sort_keys=True)
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results with a baseline. Returns the list of cases that are
+    slower than threshold times the baseline or that ran in the baseline
+    and failed now.
+    """
+    base = dict((key(r), r) for r in baseline['results'] if 'seconds' in r)
+    regressions = []
+    for r in results:
+        b = base.get(key(r))
+        if b is None:
+            continue
+        if 'error' in r:
+            regressions.append(r)
+            continue
+        ratio = r['seconds']/b['seconds']
+        r['baseline_ratio'] = ratio
+        if ratio > threshold:
+            regressions.append(r)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the numerical '
+                                     'kernels of this repository.')
+    parser.add_argument('-o', '--output', default='benchmark.json',
+                        help='Output JSON file (default: benchmark.json)')
+    parser.add_argument('--baseline', help='JSON file of a previous run')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='Allowed slowdown relative to the baseline')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of timed runs per case')
+    parser.add_argument('--quick', action='store_true',
+                        help='Only run the smaller cases')
+    parser.add_argument('--max-points', type=float, default=1e7,
+                        help='Skip batch cases with more depth samples times '
+                        'materials than this')
+    parser.add_argument('-k', '--filter', help='Only run cases whose name '
+                        'contains this string')
+    args = parser.parse_args(argv)
+
+    results = []
+    for case in cases(args.quick, args.max_points):
+        if args.filter and args.filter not in case[0]:
+            continue
+        record = run(case, args.repeat)
+        results.append(record)
+        if 'error' in record:
+            print('{:25s} {:40s} {}'.format(record['name'],
+                                             json.dumps(record['params']),
+                                             record['error']))
+        else:
+            print('{:25s} {:40s} {:10.4f} s {:12.3e} pts/s'.format(
+                record['name'], json.dumps(record['params']),
+                record['seconds'], record['points_per_second']))
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for r in regressions:
+            if 'error' in r:
+                print('REGRESSION {} {}: failed with {}'.format(
+                    r['name'], json.dumps(r['params']), r['error']))
+            else:
+                print('REGRESSION {} {}: {:.2f}x slower'.format(
+                    r['name'], json.dumps(r['params']), r['baseline_ratio']))
+        if regressions:
+            status = 1
+
+    info = dict(python=platform.python_version(), numpy=np.__version__,
+                machine=platform.machine(), node=platform.node(),
+                created=time.strftime('%Y-%m-%dT%H:%M:%S'))
+    with open(args.output, 'w') as f:
+        json.dump(dict(info=info, results=results), f, indent=1)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())